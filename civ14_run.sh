@@ -1,6 +1,9 @@
 #!/bin/sh
 git pull
 /home/python/bin/pip install numpy pyyaml pyfastnoiselite
-/home/python/bin/python mapGeneration.py
+# Takes a map pre-generated during the last round, generating one only if none is ready
+/home/python/bin/python mapGeneration.py --promote
 dotnet run --project Content.Packaging server --hybrid-acz --platform linux-x64
+# Refills the map pool for the next restart at low priority while the round runs
+/home/python/bin/python mapGeneration.py --pregenerate 2 &
 dotnet run --project Content.Server --config-file server_config.toml
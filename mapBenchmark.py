@@ -0,0 +1,317 @@
+"""Measures how each stage of mapGeneration.py scales with the map size.
+
+Every stage runs at fixed seeds over a ladder of square map sizes, and its
+wall time, tiles per second and peak traced memory are written to a JSON
+file. Passing an earlier file as --baseline compares against it and exits
+with status 1 when a stage got slower than the tolerance allows.
+
+    python mapBenchmark.py --sizes 300 600 --output before.json
+    python mapBenchmark.py --sizes 300 600 --baseline before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import mapGeneration as mg
+
+# Stages faster than this are too noisy to report as regressions
+MIN_COMPARED_SECONDS = 0.05
+
+
+def noise_cache(state):
+    """A new noise cache over the bordered map, so no stage reuses another's fields."""
+    return mg.NoiseFieldCache(
+        state["width"] + 2, state["height"] + 2, sampler=state["sampler"]
+    )
+
+
+def run_tile_map(state):
+    return mg.generate_tile_map(
+        state["width"],
+        state["height"],
+        mg.layers_of_type(mg.MAP_CONFIG, "BiomeTileLayer"),
+        state["seed"],
+        noise_cache(state),
+    )
+
+
+def run_erosion(state):
+    tile_map = mg.apply_iterative_erosion(
+        state["tile_map"],
+        mg.TILEMAP_REVERSE[mg.EROSION_TILE],
+        mg.EROSION_MIN_NEIGHBORS,
+    )
+    return mg.add_border(tile_map, border_value=mg.TILEMAP_REVERSE["FloorDirt"])
+
+
+def run_dynamic_entities(state):
+    return mg.generate_dynamic_entities(
+        state["bordered"],
+        mg.layers_of_type(mg.MAP_CONFIG, "BiomeEntityLayer"),
+        state["seed"],
+        noise_cache(state),
+    )
+
+
+def run_decals(state):
+    return mg.generate_decals(
+        state["bordered"],
+        mg.layers_of_type(mg.MAP_CONFIG, "BiomeDecalLayer"),
+        state["seed"],
+        16,
+        noise_cache(state),
+    )
+
+
+def run_spawn_area(state):
+    return mg.spawn_area(state["bordered"], state["store"])
+
+
+def run_spawn_points(state):
+    store = mg.EntityStore(first_uid=state["store"].next_uid)
+    return mg.generate_spawn_points(
+        state["bordered"],
+        seed_base=state["seed"],
+        store=store,
+        allowed=state["spawn_area"],
+    )
+
+
+def run_main_entities(state):
+    return mg.generate_main_entities(state["bordered"], 16, state["decals"])
+
+
+def run_save(state):
+    all_entities = [state["main_entities"]]
+    all_entities.extend(state["store"].groups())
+    all_entities.extend(state["spawn_store"].groups())
+    output_path = os.path.join(state["work_dir"], "map.yml")
+    mg.write_map_yaml(all_entities, output_path, state["seed"], state["workers"])
+
+
+# (stage name, function, state key its result is kept under), in the order
+# generate_map_parts runs them. Erosion includes adding the border, spawn_area
+# is the connectivity check generate_map runs by default, and write_map_yaml
+# writes the entity groups generate_all_entities would return.
+STAGES = [
+    ("generate_tile_map", run_tile_map, "tile_map"),
+    ("apply_iterative_erosion", run_erosion, "bordered"),
+    ("generate_dynamic_entities", run_dynamic_entities, "store"),
+    ("spawn_area", run_spawn_area, "spawn_area"),
+    ("generate_spawn_points", run_spawn_points, "spawn_store"),
+    ("generate_decals", run_decals, "decals"),
+    ("generate_main_entities", run_main_entities, "main_entities"),
+    ("write_map_yaml", run_save, None),
+]
+
+
+def measure(run, state, repeat, memory):
+    """Runs a stage, returns (result, best seconds of repeat runs, peak bytes).
+
+    The peak is taken on a separate run under tracemalloc, so tracing does not
+    slow down the timed runs. It is None when memory is False.
+    """
+    seconds = float("inf")
+    with mg.quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run(state)
+            seconds = min(seconds, time.perf_counter() - start)
+        peak = None
+        if memory:
+            del result
+            tracemalloc.start()
+            try:
+                result = run(state)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_size(size, seed, workers, repeat, memory):
+    """Runs every stage on a size x size map, returns its result record."""
+    state = {"width": size, "height": size, "seed": seed, "workers": workers}
+    tiles = size * size
+    stages = {}
+    sampler = None
+    if workers > 1:
+        sampler = mg.StripeNoiseSampler(size + 2, size + 2, workers, 16)
+    state["sampler"] = sampler
+    try:
+        with tempfile.TemporaryDirectory(prefix="map-benchmark-") as work_dir:
+            state["work_dir"] = work_dir
+            for name, run, key in STAGES:
+                result, seconds, peak = measure(run, state, repeat, memory)
+                if key is not None:
+                    state[key] = result
+                stages[name] = {
+                    "seconds": seconds,
+                    "tiles_per_second": tiles / seconds if seconds > 0 else None,
+                    "peak_bytes": peak,
+                }
+                peak_text = f"{peak / 1024**2:9.1f} MB" if peak is not None else ""
+                print(
+                    f"{size}x{size} seed {seed} {name:<26} {seconds:9.3f} s "
+                    f"{tiles / max(seconds, 1e-9):14,.0f} tiles/s {peak_text}"
+                )
+    finally:
+        if sampler is not None:
+            sampler.close()
+    return {
+        "width": size,
+        "height": size,
+        "seed": seed,
+        "stages": stages,
+        "total_seconds": sum(stage["seconds"] for stage in stages.values()),
+    }
+
+
+def git_commit():
+    """Returns the checked out commit of the repository, or None."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """Prints each stage's time against baseline, returns the regressed ones."""
+    previous = {
+        (result["width"], result["height"], result["seed"]): result["stages"]
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        key = (result["width"], result["height"], result["seed"])
+        if key not in previous:
+            continue
+        for name, stage in result["stages"].items():
+            before = previous[key].get(name)
+            if before is None:
+                continue
+            ratio = stage["seconds"] / max(before["seconds"], 1e-9)
+            print(
+                f"{key[0]}x{key[1]} seed {key[2]} {name:<26} "
+                f"{before['seconds']:9.3f} s -> {stage['seconds']:9.3f} s "
+                f"({ratio:.2f}x)"
+            )
+            slowest = max(stage["seconds"], before["seconds"])
+            if ratio > 1 + tolerance and slowest >= MIN_COMPARED_SECONDS:
+                regressions.append((key, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks each map generation stage over a ladder of sizes."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[300, 600, 1000, 2000, 4000],
+        metavar="N",
+        help="square map sizes to run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=[1],
+        metavar="SEED",
+        help="map seeds to run each size with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        metavar="N",
+        help="timed runs of each stage, the fastest is kept (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="processes sampling noise and writing the map; memory of the "
+        "worker processes is not traced (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="skip the traced run that measures each stage's peak memory",
+    )
+    parser.add_argument(
+        "--output",
+        default="map_benchmark.json",
+        metavar="FILE",
+        help="where the results are written (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="results of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="slowdown over --baseline reported as a regression (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    report = {
+        "generator_version": mg.GENERATOR_VERSION,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "repeat": args.repeat,
+        "results": [],
+    }
+    for size in args.sizes:
+        for seed in args.seeds:
+            report["results"].append(
+                benchmark_size(
+                    size, seed, args.workers, args.repeat, not args.no_memory
+                )
+            )
+
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        regressions = compare(report, baseline, args.tolerance)
+        for (width, height, seed), name, ratio in regressions:
+            print(
+                f"Regression: {name} at {width}x{height} seed {seed} is {ratio:.2f}x slower"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,781 @@
+"""Checks the fast paths of mapGeneration.py against plain reference code.
+
+The reference functions below generate a map the way mapGeneration.py first
+did, tile by tile with get_noise, Python loops, struct and yaml.dump, but
+with its current layer seeds and position-addressed random numbers. For each
+size and seed of a matrix they are compared with the vectorised stages, the
+maps saved by generate_map (in memory, with workers and out of core) and the
+chunks of LazyMap. Any difference is reported with the first differing
+chunk, entity or decal, and the script then exits with status 1.
+
+    python mapEquivalence.py --sizes 33x71 120x100 --seeds 1 2 3
+"""
+
+import argparse
+import base64
+import os
+import re
+import struct
+import sys
+import tempfile
+from collections import defaultdict, deque
+
+import numpy as np
+import yaml
+
+import mapGeneration as mg
+
+CHUNK_SIZE = 16
+
+
+def random_at(seed_base, stream, x, y):
+    return float(mg.position_random(seed_base, stream, np.array([x]), np.array([y]))[0])
+
+
+def choice_at(seed_base, stream, x, y, count):
+    return int(
+        mg.position_choice(seed_base, stream, np.array([x]), np.array([y]), count)[0]
+    )
+
+
+def bits_at(seed_base, stream, x, y):
+    return int(mg.position_bits(seed_base, stream, np.array([x]), np.array([y]))[0])
+
+
+# -----------------------------------------------------------------------------
+# Reference implementation
+# -----------------------------------------------------------------------------
+def reference_tile_map(width, height, tile_layers, seed_base):
+    """Places the tile layers one tile at a time."""
+    tile_map = np.full((height, width), mg.TILEMAP_REVERSE["FloorDirt"], np.int32)
+    for layer in sorted(tile_layers, key=lambda layer: layer.get("priority", 1)):
+        seed_key = layer.get("seed_key", layer["tile_type"])
+        noise = mg.make_noise(layer, mg.layer_seed(seed_base, seed_key))
+        mod_noise = None
+        if "modulation" in layer:
+            mod_config = layer["modulation"]
+            mod_noise = mg.make_noise(
+                mod_config, mg.layer_seed(seed_base, seed_key + "_mod")
+            )
+            threshold_min = mod_config.get("threshold_min", 0.4)
+            threshold_max = mod_config.get("threshold_max", 0.6)
+        dont_overwrite = [mg.TILEMAP_REVERSE[t] for t in layer.get("dontOverwrite", [])]
+
+        for y in range(height):
+            for x in range(width):
+                noise_value = (noise.get_noise(x, y) + 1) / 2
+                if not noise_value > layer["threshold"]:
+                    continue
+                if mod_noise is not None:
+                    mod_value = (mod_noise.get_noise(x, y) + 1) / 2
+                    if mod_value <= threshold_min:
+                        continue
+                    if mod_value <= threshold_max:
+                        probability = (mod_value - threshold_min) / (
+                            threshold_max - threshold_min
+                        )
+                        stream = ("modulation", seed_key)
+                        if not random_at(seed_base, stream, x, y) < probability:
+                            continue
+                current_tile = tile_map[y, x]
+                if current_tile in dont_overwrite:
+                    continue
+                if (
+                    layer.get("overwrite", True)
+                    or current_tile == mg.TILEMAP_REVERSE["Space"]
+                ):
+                    tile_map[y, x] = mg.TILEMAP_REVERSE[layer["tile_type"]]
+    return tile_map
+
+
+def reference_isolated(tile_map, y, x, tile_type, min_neighbors):
+    """Returns the neighbour types of tile (x, y) if it is isolated, else None."""
+    neighbor_types = []
+    neighbors = 0
+    for dy in [-1, 0, 1]:
+        for dx in [-1, 0, 1]:
+            if dy == 0 and dx == 0:
+                continue
+            neighbor_type = tile_map[y + dy, x + dx]
+            neighbor_types.append(neighbor_type)
+            if neighbor_type == tile_type:
+                neighbors += 1
+    return neighbor_types if neighbors < min_neighbors else None
+
+
+def reference_erosion(tile_map, tile_type, min_neighbors, max_iterations=10):
+    """Erodes isolated tiles pass by pass, tile by tile."""
+    h, w = tile_map.shape
+
+    def isolated_tiles(tiles):
+        return [
+            (y, x, neighbor_types)
+            for y in range(1, h - 1)
+            for x in range(1, w - 1)
+            if tiles[y, x] == tile_type
+            for neighbor_types in [
+                reference_isolated(tiles, y, x, tile_type, min_neighbors)
+            ]
+            if neighbor_types is not None
+        ]
+
+    for _ in range(max_iterations):
+        isolated = isolated_tiles(tile_map)
+        eroded = tile_map.copy()
+        for y, x, neighbor_types in isolated:
+            counts = defaultdict(int)
+            for neighbor_type in neighbor_types:
+                counts[neighbor_type] += 1
+            max_count = max(counts.values())
+            eroded[y, x] = [t for t, count in counts.items() if count == max_count][0]
+        tile_map = eroded
+        isolated_after = len(isolated_tiles(tile_map))
+        if isolated_after == len(isolated) or isolated_after == 0:
+            break
+    return tile_map
+
+
+def on_border(x, y, w, h):
+    return x == 0 or x == w - 1 or y == 0 or y == h - 1
+
+
+def reference_entities(tile_map, entity_layers, seed_base):
+    """Returns {proto: [(uid, x, y)]} of the entity layers and walls, and the next uid."""
+    h, w = tile_map.shape
+    groups = {}
+    uid = 3
+    occupied = set()
+    sorted_layers = sorted(
+        entity_layers, key=lambda layer: layer.get("priority", 0), reverse=True
+    )
+    for layer in sorted_layers:
+        entity_protos = layer["entity_protos"]
+        if isinstance(entity_protos, str):
+            entity_protos = [entity_protos]
+        seed_key = layer.get("seed_key", tuple(entity_protos))
+        noise = mg.make_noise(layer, mg.layer_seed(seed_base, seed_key))
+        stream = ("entities", tuple(entity_protos))
+        for y in range(h):
+            for x in range(w):
+                if on_border(x, y, w, h) or (x, y) in occupied:
+                    continue
+                noise_value = (noise.get_noise(x, y) + 1) / 2
+                if noise_value > layer["threshold"] and layer["tile_condition"](
+                    tile_map[y, x]
+                ):
+                    choice = choice_at(seed_base, stream, x, y, len(entity_protos))
+                    groups.setdefault(entity_protos[choice], []).append((uid, x, y))
+                    uid += 1
+                    occupied.add((x, y))
+
+    walls = groups.setdefault("WallRockIndestructible", [])
+    for y in range(h):
+        for x in range(w):
+            if on_border(x, y, w, h):
+                walls.append((uid, x, y))
+                uid += 1
+    return groups, uid
+
+
+def reference_spawn_area(tile_map, entities):
+    """Returns the set of (x, y) of the largest walkable area, flood filled.
+
+    Walkable tiles are not Space and hold no blocking entity. Areas are
+    filled from their first tile in row-major order, and the first of the
+    largest ones is kept.
+    """
+    h, w = tile_map.shape
+    blocked = {
+        (x, y) for proto in mg.BLOCKING_PROTOS for _, x, y in entities.get(proto, [])
+    }
+    space = mg.TILEMAP_REVERSE["Space"]
+
+    def walkable(x, y):
+        return (
+            0 <= x < w
+            and 0 <= y < h
+            and tile_map[y, x] != space
+            and (x, y) not in blocked
+        )
+
+    seen = set()
+    largest = set()
+    for y in range(h):
+        for x in range(w):
+            if (x, y) in seen or not walkable(x, y):
+                continue
+            area = {(x, y)}
+            queue = deque([(x, y)])
+            while queue:
+                ax, ay = queue.popleft()
+                for nx, ny in [(ax - 1, ay), (ax + 1, ay), (ax, ay - 1), (ax, ay + 1)]:
+                    if (nx, ny) not in area and walkable(nx, ny):
+                        area.add((nx, ny))
+                        queue.append((nx, ny))
+            seen |= area
+            if len(area) > len(largest):
+                largest = area
+    return largest
+
+
+def reference_spawn_points(tile_map, seed_base, uid, area=None):
+    """Returns {proto: [(uid, x, y)]} of the spawn points, searched tile by tile.
+
+    With an area, from reference_spawn_area, both tiles of a spawn pair must
+    lie in it.
+    """
+    h, w = tile_map.shape
+    grass = mg.TILEMAP_REVERSE["FloorPlanetGrass"]
+    directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    used = set()
+    groups = {"SpawnPointNomads": [], "SpawnPointLatejoin": []}
+
+    def free_grass(x, y):
+        return (
+            0 <= x < w
+            and 0 <= y < h
+            and tile_map[y, x] == grass
+            and (x, y) not in used
+            and (area is None or (x, y) in area)
+        )
+
+    for corner in ["top_left", "top_right", "bottom_left", "bottom_right"]:
+        size = 15
+        candidates = []
+        while not candidates and size <= min(w, h) // 2:
+            x_min, x_max = (
+                (max(w - 1 - size, 1), w - 2)
+                if "right" in corner
+                else (1, min(size, w - 2))
+            )
+            y_min, y_max = (
+                (max(h - 1 - size, 1), h - 2)
+                if "bottom" in corner
+                else (1, min(size, h - 2))
+            )
+            for y in range(y_min, y_max + 1):
+                for x in range(x_min, x_max + 1):
+                    if not free_grass(x, y):
+                        continue
+                    adjacent = [
+                        (x + dx, y + dy)
+                        for dx, dy in directions
+                        if free_grass(x + dx, y + dy)
+                    ]
+                    if adjacent:
+                        candidates.append((x, y, adjacent))
+            size += 1
+        if not candidates:
+            continue
+
+        # The candidate, and then its neighbour, with the lowest random rank
+        x, y, adjacent = min(
+            candidates, key=lambda c: bits_at(seed_base, ("spawn", corner), c[0], c[1])
+        )
+        adjacent_stream = ("spawn", corner, "adjacent")
+        adj_x, adj_y = min(
+            adjacent, key=lambda a: bits_at(seed_base, adjacent_stream, a[0], a[1])
+        )
+        if random_at(seed_base, ("spawn", corner, "swap"), x, y) < 0.5:
+            nomads_pos, latejoin_pos = (x, y), (adj_x, adj_y)
+        else:
+            nomads_pos, latejoin_pos = (adj_x, adj_y), (x, y)
+        groups["SpawnPointNomads"].append((uid, *nomads_pos))
+        groups["SpawnPointLatejoin"].append((uid + 1, *latejoin_pos))
+        uid += 2
+        used.add(nomads_pos)
+        used.add(latejoin_pos)
+    return groups
+
+
+def reference_decals(tile_map, decal_layers, seed_base):
+    """Returns {decal_id: [(color, position)]}, placed tile by tile."""
+    h, w = tile_map.shape
+    decals_by_id = {}
+    occupied = set()
+    for layer in decal_layers:
+        decal_ids = layer["decal_id"]
+        if isinstance(decal_ids, list):
+            seed_key = layer.get("seed_key", tuple(decal_ids))
+        else:
+            seed_key = layer.get("seed_key", decal_ids)
+            decal_ids = [decal_ids]
+        noise = mg.make_noise(layer, mg.layer_seed(seed_base, seed_key))
+        stream = ("decals", tuple(decal_ids))
+        color = layer.get("color", "#FFFFFFFF")
+        for y in range(h):
+            for x in range(w):
+                if on_border(x, y, w, h) or (x, y) in occupied:
+                    continue
+                noise_value = (noise.get_noise(x, y) + 1) / 2
+                if noise_value > layer["threshold"] and layer["tile_condition"](
+                    tile_map[y, x]
+                ):
+                    decal_id = decal_ids[
+                        choice_at(seed_base, stream, x, y, len(decal_ids))
+                    ]
+                    # Small random offset for decals, between -0.25 and 0.25
+                    pos_x = x + (noise.get_noise(x + 1000, y + 1000) + 1) / 4 - 0.25
+                    pos_y = y + (noise.get_noise(x + 2000, y + 2000) + 1) / 4 - 0.25
+                    decals_by_id.setdefault(decal_id, []).append(
+                        (color, f"{pos_x:.7f},{pos_y:.7f}")
+                    )
+                    occupied.add((x, y))
+    return decals_by_id
+
+
+def reference_encode_tiles(tiles):
+    """Packs tiles one at a time: 4 bytes id, 1 byte flags, 1 byte variant."""
+    tile_bytes = bytearray()
+    for y in range(tiles.shape[0]):
+        for x in range(tiles.shape[1]):
+            tile_bytes.extend(struct.pack("<I", int(tiles[y, x])))
+            tile_bytes.append(0)
+            tile_bytes.append(0)
+    return base64.b64encode(tile_bytes).decode("utf-8")
+
+
+def padded_chunk(tile_map, cx, cy):
+    """Returns chunk (cx, cy) of tile_map, padded with Space to a full chunk."""
+    chunk = np.zeros((CHUNK_SIZE, CHUNK_SIZE), np.int32)
+    tiles = tile_map[
+        cy * CHUNK_SIZE : (cy + 1) * CHUNK_SIZE, cx * CHUNK_SIZE : (cx + 1) * CHUNK_SIZE
+    ]
+    chunk[: tiles.shape[0], : tiles.shape[1]] = tiles
+    return chunk
+
+
+def chunk_indices(tile_map):
+    h, w = tile_map.shape
+    return [
+        (cx, cy)
+        for cy in range(-(-h // CHUNK_SIZE))
+        for cx in range(-(-w // CHUNK_SIZE))
+    ]
+
+
+def reference_atmosphere_tiles(width, height, chunk_size):
+    max_x = (width + chunk_size - 1) // chunk_size - 1
+    max_y = (height + chunk_size - 1) // chunk_size - 1
+    tiles = {}
+    for y in range(-1, max_y + 1):
+        for x in range(-1, max_x + 1):
+            if x == -1 or x == max_x or y == -1 or y == max_y:
+                tiles[f"{x},{y}"] = {0: 65535}
+            else:
+                tiles[f"{x},{y}"] = {1: 65535}
+    return tiles
+
+
+def represent_sound_path_specifier(dumper, data):
+    """Customised representation for the SoundPathSpecifier in the YAML."""
+    for key, value in data.items():
+        if isinstance(key, str) and key.startswith("!type:"):
+            if isinstance(value, dict) and "path" in value:
+                return dumper.represent_mapping(key, value)
+    return dumper.represent_dict(data)
+
+
+class ReferenceDumper(yaml.Dumper):
+    pass
+
+
+ReferenceDumper.add_representer(dict, represent_sound_path_specifier)
+
+
+def reference_yaml(reference, seed_base):
+    """Dumps the reference map the way the map was first saved, with yaml.dump."""
+    tile_map = reference["tiles"]
+    h, w = tile_map.shape
+    chunks = {
+        f"{cx},{cy}": {"ind": f"{cx},{cy}", "tiles": encoded, "version": 6}
+        for (cx, cy), encoded in reference["chunks"].items()
+    }
+    decal_nodes = []
+    global_index = 0
+    for decal_id, decals in reference["decals"].items():
+        node_decals = {}
+        for _, position in decals:
+            node_decals[str(global_index)] = position
+            global_index += 1
+        decal_nodes.append(
+            {"node": {"color": decals[0][0], "id": decal_id}, "decals": node_decals}
+        )
+    all_entities = [
+        mg.main_entity_group(
+            chunks, decal_nodes, reference_atmosphere_tiles(w, h, 4), 4
+        )
+    ]
+    for proto, entities in reference["entities"].items():
+        all_entities.append(
+            {
+                "proto": proto,
+                "entities": [
+                    {
+                        "uid": uid,
+                        "components": [
+                            {"type": "Transform", "parent": 2, "pos": f"{x},{y}"}
+                        ],
+                    }
+                    for uid, x, y in entities
+                ],
+            }
+        )
+    count = sum(len(group["entities"]) for group in all_entities)
+    map_data = mg.map_header(count, seed_base)
+    map_data["entities"] = all_entities
+    return yaml.dump(
+        map_data, Dumper=ReferenceDumper, default_flow_style=False, sort_keys=False
+    )
+
+
+def reference_map(width, height, seed_base, config):
+    """Generates the whole map with the reference functions.
+
+    Its spawn points are only placed on reference_spawn_area, as generate_map
+    places them by default.
+    """
+    tile_map = reference_tile_map(
+        width, height, mg.layers_of_type(config, "BiomeTileLayer"), seed_base
+    )
+    tile_map = reference_erosion(
+        tile_map, mg.TILEMAP_REVERSE[mg.EROSION_TILE], mg.EROSION_MIN_NEIGHBORS
+    )
+    bordered = np.pad(tile_map, 1, constant_values=mg.TILEMAP_REVERSE["FloorDirt"])
+    entities, uid = reference_entities(
+        bordered, mg.layers_of_type(config, "BiomeEntityLayer"), seed_base
+    )
+    area = reference_spawn_area(bordered, entities)
+    reference = {
+        "tiles": bordered,
+        "chunks": {
+            index: reference_encode_tiles(padded_chunk(bordered, *index))
+            for index in chunk_indices(bordered)
+        },
+        "entities": {
+            **entities,
+            **reference_spawn_points(bordered, seed_base, uid, area),
+        },
+        "decals": reference_decals(
+            bordered, mg.layers_of_type(config, "BiomeDecalLayer"), seed_base
+        ),
+    }
+    reference["yaml"] = reference_yaml(reference, seed_base)
+    return reference
+
+
+# -----------------------------------------------------------------------------
+# Fast paths
+# -----------------------------------------------------------------------------
+def fast_map(width, height, seed_base, config):
+    """Generates the map with generate_map_parts, the stages of generate_map."""
+    with mg.quiet():
+        parts = mg.generate_map_parts(
+            width, height, seed_base, config, chunk_size=CHUNK_SIZE
+        )
+    return {
+        "tiles": parts["tile_map"],
+        "chunks": mg.encode_chunks(parts["tile_map"], CHUNK_SIZE),
+        "entities": {
+            group["proto"]: list(
+                zip(group["uids"].tolist(), group["xs"].tolist(), group["ys"].tolist())
+            )
+            for group in parts["store"].groups()
+        },
+        "decals": {
+            decal_id: [(decal["color"], decal["position"]) for decal in decals]
+            for decal_id, decals in parts["decals"].items()
+        },
+    }
+
+
+def saved_map(width, height, seed_base, config, **options):
+    """Returns the text of the map generate_map saves with options."""
+    with tempfile.TemporaryDirectory(prefix="map-equivalence-") as temp_dir:
+        output = os.path.join(temp_dir, "map.yml")
+        with mg.quiet():
+            mg.generate_map(
+                width,
+                height,
+                seed_base,
+                config,
+                output,
+                **options,
+            )
+        with open(output) as infile:
+            return infile.read()
+
+
+# -----------------------------------------------------------------------------
+# Comparisons, each returns None or a description of the first difference
+# -----------------------------------------------------------------------------
+def tile_name(tile_id):
+    return mg.TILEMAP.get(int(tile_id), tile_id)
+
+
+def compare_tiles(reference, fast):
+    if reference.shape != fast.shape:
+        return f"tile map is {fast.shape} instead of {reference.shape}"
+    differing = np.argwhere(reference != fast)
+    if not differing.size:
+        return None
+    y, x = min(
+        differing.tolist(),
+        key=lambda yx: (yx[0] // CHUNK_SIZE, yx[1] // CHUNK_SIZE, yx[0], yx[1]),
+    )
+    return (
+        f"chunk {x // CHUNK_SIZE},{y // CHUNK_SIZE}: tile {x},{y} is "
+        f"{tile_name(fast[y, x])} instead of {tile_name(reference[y, x])}"
+    )
+
+
+def compare_chunks(reference, fast):
+    for index, encoded in reference.items():
+        if index not in fast:
+            return f"chunk {index[0]},{index[1]} is missing"
+        if fast[index] != encoded:
+            return f"chunk {index[0]},{index[1]}: encoded tiles differ"
+    extra = [index for index in fast if index not in reference]
+    if extra:
+        return f"chunk {extra[0][0]},{extra[0][1]} should not exist"
+    return None
+
+
+def compare_sequences(kind, reference, fast, describe):
+    """Compares two lists in order, naming the first differing item."""
+    for index, (expected, actual) in enumerate(zip(reference, fast)):
+        if expected != actual:
+            return (
+                f"{kind} #{index} is {describe(actual)} "
+                f"instead of {describe(expected)}"
+            )
+    if len(fast) < len(reference):
+        return f"{kind} #{len(fast)} {describe(reference[len(fast)])} is missing"
+    if len(fast) > len(reference):
+        return f"{kind} #{len(reference)} {describe(fast[len(reference)])} is extra"
+    return None
+
+
+def compare_entities(reference, fast):
+    def flatten(groups):
+        return [
+            (proto, uid, x, y)
+            for proto, entities in groups.items()
+            for uid, x, y in entities
+        ]
+
+    def describe(entity):
+        proto, uid, x, y = entity
+        return f"uid {uid} {proto} at {x},{y}"
+
+    return compare_sequences("entity", flatten(reference), flatten(fast), describe)
+
+
+def compare_decals(reference, fast):
+    def flatten(decals_by_id):
+        return [
+            (decal_id, color, position)
+            for decal_id, decals in decals_by_id.items()
+            for color, position in decals
+        ]
+
+    def describe(decal):
+        decal_id, color, position = decal
+        return f"{decal_id} {color} at {position}"
+
+    return compare_sequences("decal", flatten(reference), flatten(fast), describe)
+
+
+# The entity, chunk or grid component a line of the saved map belongs to
+ENTITY_LINE = re.compile(r"^\s*- uid: (\d+)$")
+CHUNK_LINE = re.compile(r"^\s*ind: (-?\d+,-?\d+)$")
+COMPONENT_LINE = re.compile(r"^\s*- type: (DecalGrid|GridAtmosphere)$")
+
+
+def shorten(line, length=60):
+    """The stripped line quoted, cut down to about length characters."""
+    line = line.strip()
+    if len(line) > length:
+        line = line[: length - 3] + "..."
+    return repr(line)
+
+
+def compare_yaml(reference, fast):
+    reference_lines = reference.splitlines()
+    fast_lines = fast.splitlines()
+    for number, (expected, actual) in enumerate(zip(reference_lines, fast_lines)):
+        if expected != actual:
+            break
+    else:
+        if len(reference_lines) == len(fast_lines):
+            return None
+        number = min(len(reference_lines), len(fast_lines))
+        expected = reference_lines[number] if number < len(reference_lines) else ""
+        actual = fast_lines[number] if number < len(fast_lines) else ""
+
+    where = ""
+    for line in reversed(reference_lines[: number + 1]):
+        match = ENTITY_LINE.match(line)
+        if match:
+            where = f", in entity uid {match.group(1)}"
+            break
+        match = CHUNK_LINE.match(line)
+        if match:
+            where = f", in chunk {match.group(1)}"
+            break
+        match = COMPONENT_LINE.match(line)
+        if match:
+            where = f", in the grid's {match.group(1)}"
+            break
+    return f"line {number + 1}{where}: {shorten(actual)} instead of {shorten(expected)}"
+
+
+def compare_lazy_chunks(reference, width, height, seed_base, config):
+    """Compares every chunk of a LazyMap with the same area of the reference.
+
+    Chunks leave the spawn points out, they are compared with the ones
+    LazyMap.spawn_points places for the whole map.
+    """
+    lazy = mg.LazyMap(width, height, seed_base, config, CHUNK_SIZE)
+    entities_by_chunk = defaultdict(list)
+    for proto, entities in reference["entities"].items():
+        if proto in mg.SPAWN_PROTOS:
+            continue
+        for _, x, y in entities:
+            entities_by_chunk[x // CHUNK_SIZE, y // CHUNK_SIZE].append(
+                (proto, f"{x},{y}")
+            )
+    decals_by_chunk = defaultdict(list)
+    for decal_id, decals in reference["decals"].items():
+        for color, position in decals:
+            x, y = (round(float(value)) for value in position.split(","))
+            decals_by_chunk[x // CHUNK_SIZE, y // CHUNK_SIZE].append(
+                (decal_id, color, position)
+            )
+
+    with mg.quiet():
+        for cx, cy in chunk_indices(reference["tiles"]):
+            chunk = lazy.chunk(cx, cy)
+            tiles = padded_chunk(reference["tiles"], cx, cy)
+            differing = np.argwhere(tiles != chunk["tiles"])
+            if differing.size:
+                y, x = differing[0].tolist()
+                return (
+                    f"chunk {cx},{cy}: tile {cx * CHUNK_SIZE + x},{cy * CHUNK_SIZE + y} "
+                    f"is {tile_name(chunk['tiles'][y, x])} "
+                    f"instead of {tile_name(tiles[y, x])}"
+                )
+            expected = sorted(entities_by_chunk[cx, cy])
+            actual = sorted(
+                (entity["proto"], entity["pos"]) for entity in chunk["entities"]
+            )
+            if actual != expected:
+                missing = sorted(set(expected) - set(actual))
+                extra = sorted(set(actual) - set(expected))
+                return f"chunk {cx},{cy}: entities missing {missing[:3]}, extra {extra[:3]}"
+            expected = sorted(decals_by_chunk[cx, cy])
+            actual = sorted(
+                (decal["id"], decal["color"], decal["position"])
+                for decal in chunk["decals"]
+            )
+            if actual != expected:
+                missing = sorted(set(expected) - set(actual))
+                extra = sorted(set(actual) - set(expected))
+                return (
+                    f"chunk {cx},{cy}: decals missing {missing[:3]}, extra {extra[:3]}"
+                )
+        spawn_points = {
+            group["proto"]: list(zip(group["xs"].tolist(), group["ys"].tolist()))
+            for group in lazy.spawn_points().groups()
+        }
+    for proto in mg.SPAWN_PROTOS:
+        expected = [(x, y) for _, x, y in reference["entities"][proto]]
+        if spawn_points.get(proto, []) != expected:
+            return f"{proto} at {spawn_points.get(proto, [])} instead of {expected}"
+    return None
+
+
+def check_map(width, height, seed_base, workers, config):
+    """Compares every fast path on one map, returns [(check, difference)]."""
+    with mg.quiet():
+        reference = reference_map(width, height, seed_base, config)
+    fast = fast_map(width, height, seed_base, config)
+    checks = [
+        ("tiles", lambda: compare_tiles(reference["tiles"], fast["tiles"])),
+        ("chunks", lambda: compare_chunks(reference["chunks"], fast["chunks"])),
+        ("entities", lambda: compare_entities(reference["entities"], fast["entities"])),
+        ("decals", lambda: compare_decals(reference["decals"], fast["decals"])),
+        (
+            "saved map",
+            lambda: compare_yaml(
+                reference["yaml"], saved_map(width, height, seed_base, config)
+            ),
+        ),
+        (
+            f"saved map, {workers} workers",
+            lambda: compare_yaml(
+                reference["yaml"],
+                saved_map(width, height, seed_base, config, workers=workers),
+            ),
+        ),
+        (
+            "saved map, out of core",
+            lambda: compare_yaml(
+                reference["yaml"],
+                saved_map(width, height, seed_base, config, out_of_core=True),
+            ),
+        ),
+        (
+            "lazy chunks",
+            lambda: compare_lazy_chunks(reference, width, height, seed_base, config),
+        ),
+    ]
+    return [(name, check()) for name, check in checks]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the map generator's fast paths with reference code."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=mg.map_size,
+        nargs="+",
+        default=[(16, 16), (33, 71), (120, 100)],
+        metavar="WxH",
+        help="map sizes to check (default: 16x16 33x71 120x100)",
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=[1, 2, 3],
+        metavar="SEED",
+        help="map seeds to check each size with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        metavar="N",
+        help="workers of the parallel saved map check (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    for width, height in args.sizes:
+        for seed in args.seeds:
+            results = check_map(width, height, seed, args.workers, mg.MAP_CONFIG)
+            for name, difference in results:
+                if difference is not None:
+                    failures += 1
+                    print(f"{width}x{height} seed {seed} {name}: {difference}")
+            if all(difference is None for _, difference in results):
+                print(f"{width}x{height} seed {seed}: all {len(results)} checks match")
+    if failures:
+        print(f"{failures} checks differ from the reference")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
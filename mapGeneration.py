@@ -1,9 +1,7 @@
 import numpy as np
 import yaml
 import base64
-import struct
 import random
-import sys
 
 from pyfastnoiselite.pyfastnoiselite import (
     FastNoiseLite,
@@ -15,15 +13,20 @@ from pyfastnoiselite.pyfastnoiselite import (
 )
 import time
 import os
-
-if len(sys.argv) == 1:
-    mapWidth = 300
-    mapHeight = 300
-    print(f"No custom mapsize specified, using defaults: {mapWidth}w x {mapHeight}h")
-else:
-    mapWidth = int(sys.argv[1])
-    mapHeight = int(sys.argv[2])
-    print(f"Using specified mapsize: {mapWidth}w x {mapHeight}h")
+import argparse
+import cProfile
+import contextlib
+import functools
+import hashlib
+import json
+import re
+import shutil
+import socket
+import tempfile
+import tracemalloc
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing import shared_memory
 
 # -----------------------------------------------------------------------------
 # Tilemap
@@ -37,308 +40,1010 @@ TILEMAP = {
     5: "FloorDirtRock",
 }
 TILEMAP_REVERSE = {v: k for k, v in TILEMAP.items()}
+# Tile ids are kept in the smallest type that holds them, and only widened
+# to the 4 byte ids of the saved map when encoding
+TILE_DTYPE = np.min_scalar_type(max(TILEMAP))
 
 
 # -----------------------------------------------------------------------------
 # Helper Functions
 # -----------------------------------------------------------------------------
+def layers_of_type(config, layer_type):
+    """Returns the layers of config of type layer_type, in config order."""
+    return [layer for layer in config if layer["type"] == layer_type]
+
+
+# Placement order of the layer types, as (default priority, highest first):
+# tile layers go from the lowest priority up, so higher ones overwrite them,
+# and entity layers from the highest down, so they claim their tiles first.
+# Decal layers keep their config order.
+LAYER_ORDER = {"BiomeTileLayer": (1, False), "BiomeEntityLayer": (0, True)}
+
+
+def ordered_layers(config, layer_type):
+    """Returns the layers of config of type layer_type, in placement order."""
+    layers = layers_of_type(config, layer_type)
+    if layer_type not in LAYER_ORDER:
+        return layers
+    default_priority, reverse = LAYER_ORDER[layer_type]
+    return sorted(
+        layers,
+        key=lambda layer: layer.get("priority", default_priority),
+        reverse=reverse,
+    )
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the generator's progress prints."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def map_size(text):
+    """Parses WIDTHxHEIGHT, the argparse type of the map size options."""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    return width, height
+
+
 def round_to_chunk(number, chunk):
     """Rounds a number to the inferior multiplier of a chunk."""
     return number - (number % chunk)
 
 
+def border_mask(height, width, y_start=0, y_end=None, x_start=0, x_end=None):
+    """Returns a boolean mask that is True on the outermost ring of tiles.
+
+    With the start and end arguments only that window of the map is returned.
+    """
+    if y_end is None:
+        y_end = height
+    if x_end is None:
+        x_end = width
+    ys = np.arange(y_start, y_end)[:, None]
+    xs = np.arange(x_start, x_end)[None, :]
+    return (ys == 0) | (ys == height - 1) | (xs == 0) | (xs == width - 1)
+
+
+def iter_choice_groups(choices):
+    """Yields (choice, mask) for each distinct choice, in order of first appearance."""
+    chosen, first_index = np.unique(choices, return_index=True)
+    for choice in chosen[np.argsort(first_index)]:
+        yield choice, choices == choice
+
+
+def tile_condition_mask(tile_map, tile_condition):
+    """Evaluates a layer's tile_condition for every tile through a lookup table."""
+    lookup = np.array(
+        [bool(tile_condition(tile_id)) for tile_id in range(max(TILEMAP) + 1)]
+    )
+    return lookup[tile_map]
+
+
 def add_border(tile_map, border_value):
     """Adds a border to tile_map with the specified value."""
     bordered = np.pad(
         tile_map, pad_width=1, mode="constant", constant_values=border_value
     )
-    return bordered.astype(np.int32)
+    return bordered.astype(TILE_DTYPE)
+
+
+# Serialized tile: 4 bytes tile_id, 1 byte flags, 1 byte variant
+TILE_RECORD = np.dtype([("id", "<u4"), ("flags", "u1"), ("variant", "u1")])
 
 
 def encode_tiles(tile_map):
     """Codifies the tiles in base64 for the YAML."""
-    tile_bytes = bytearray()
-    for y in range(tile_map.shape[0]):  # u
-        for x in range(tile_map.shape[1]):
-            tile_id = tile_map[y, x]
-            flags = 0
-            variant = 0
-            tile_bytes.extend(struct.pack("<I", tile_id))  # 4 bytes tile_id
-            tile_bytes.append(flags)  # 1 byte flag
-            tile_bytes.append(variant)  # 1 byte variant
-    return base64.b64encode(tile_bytes).decode("utf-8")
+    records = np.zeros(tile_map.shape, dtype=TILE_RECORD)
+    records["id"] = tile_map
+    return base64.b64encode(records.tobytes()).decode("utf-8")
+
+
+def encode_chunks(tile_map, chunk_size=16):
+    """Codifies every chunk of tile_map at once, keyed by (chunk_x, chunk_y).
+
+    The map is padded with Space to whole chunks and laid out chunk by chunk,
+    so each chunk is a contiguous slice of one packed record buffer.
+    """
+    h, w = tile_map.shape
+    chunk_rows = -(-h // chunk_size)
+    chunk_cols = -(-w // chunk_size)
+    records = np.zeros(
+        (chunk_rows * chunk_size, chunk_cols * chunk_size), dtype=TILE_RECORD
+    )
+    records["id"][:h, :w] = tile_map
+    chunk_major = records.reshape(chunk_rows, chunk_size, chunk_cols, chunk_size)
+    buffer = memoryview(np.ascontiguousarray(chunk_major.swapaxes(1, 2)).tobytes())
+
+    chunk_bytes = chunk_size * chunk_size * TILE_RECORD.itemsize
+    encoded = {}
+    for index in range(chunk_rows * chunk_cols):
+        cy, cx = divmod(index, chunk_cols)
+        chunk = buffer[index * chunk_bytes : (index + 1) * chunk_bytes]
+        encoded[(cx, cy)] = base64.b64encode(chunk).decode("utf-8")
+    return encoded
+
+
+# -----------------------------------------------------------------------------
+# Run profiling
+# -----------------------------------------------------------------------------
+# The profile of the running generation, set by profile_run for --profile.
+# Stages and layers record into it through profile_stage and profile_layer,
+# which do nothing while it is None.
+active_profile = None
+
+
+class RunProfile:
+    """Time, noise samples, placements and traced memory per stage and layer.
+
+    Spans of the same stage, or of the same layer within a stage, add up, so
+    out-of-core generation reports each once over all of its bands. peak_bytes
+    is the most memory tracemalloc traced while a span ran, 0 if it is not
+    tracing; work done in worker processes is timed but not traced.
+    """
+
+    def __init__(self, config):
+        self.noise_samples = 0
+        self.stages = {}
+        self._layer_index = {id(layer): index for index, layer in enumerate(config)}
+        self._stack = []  # [record, peak so far] of the open spans
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {**self._new_record(), "layers": {}}
+        return self._span(self.stages[name])
+
+    def layer(self, layer):
+        """Spans a MAP_CONFIG layer, under the innermost open stage."""
+        label = (
+            layer.get("tile_type") or layer.get("entity_protos") or layer["decal_id"]
+        )
+        if not isinstance(label, str):
+            label = ", ".join(label)
+        name = f"{self._layer_index.get(id(layer))}: {label}"
+        layers = self._stack[-1][0]["layers"] if self._stack else {}
+        if name not in layers:
+            layers[name] = {"type": layer["type"], **self._new_record(), "placed": 0}
+        return self._span(layers[name])
+
+    def _new_record(self):
+        return {"seconds": 0.0, "calls": 0, "noise_samples": 0, "peak_bytes": 0}
+
+    @contextlib.contextmanager
+    def _span(self, record):
+        self._record_peak(self._take_traced_peak())
+        frame = [record, 0]
+        self._stack.append(frame)
+        samples = self.noise_samples
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] += time.perf_counter() - start
+            record["calls"] += 1
+            record["noise_samples"] += self.noise_samples - samples
+            self._stack.pop()
+            peak = max(frame[1], self._take_traced_peak())
+            record["peak_bytes"] = max(record["peak_bytes"], peak)
+            self._record_peak(peak)
+
+    def _record_peak(self, peak):
+        if self._stack:
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+
+    def _take_traced_peak(self):
+        """Returns the traced peak since the last call, and starts a new one."""
+        if not tracemalloc.is_tracing():
+            return 0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        return peak
+
+
+def profile_stage(name):
+    """Spans a generation stage in the active profile.
+
+    The span yields the stage's record, or an unused dict when not profiling.
+    """
+    if active_profile is None:
+        return contextlib.nullcontext({"placed": 0})
+    return active_profile.stage(name)
+
+
+def profile_layer(layer):
+    """Spans a layer in the active profile, callers add to record["placed"]."""
+    if active_profile is None:
+        return contextlib.nullcontext({"placed": 0})
+    return active_profile.layer(layer)
+
+
+def count_noise_samples(count):
+    if active_profile is not None:
+        active_profile.noise_samples += count
+
+
+@contextlib.contextmanager
+def profile_run(output, config, details, cprofile=False):
+    """Profiles the generation run inside the block.
+
+    The report is written next to output, with its extension replaced by
+    .profile.json, and holds details, the total time and the stages. Memory is
+    traced for the run, which slows down stages that make many Python objects.
+    With cprofile a cProfile dump is also written, with the extension .prof.
+    """
+    global active_profile
+    base_path = os.path.splitext(output)[0]
+    active_profile = RunProfile(config)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if cprofile else None
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield active_profile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        report = dict(details)
+        report["seconds"] = seconds
+        report["noise_samples"] = active_profile.noise_samples
+        report["stages"] = active_profile.stages
+        active_profile = None
+        if started_tracing:
+            tracemalloc.stop()
+        with open(f"{base_path}.profile.json", "w") as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Profile written to {base_path}.profile.json")
+        if profiler is not None:
+            profiler.dump_stats(f"{base_path}.prof")
+            print(f"cProfile dump written to {base_path}.prof")
+
+
+# -----------------------------------------------------------------------------
+# Position-addressed random numbers
+# -----------------------------------------------------------------------------
+# Every random decision is a pure function of (seed, stream, x, y), so any tile
+# gives the same result whatever was generated before it, and a region can be
+# generated on its own or out of order.
+MASK64 = 2**64 - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+
+def stable_hash(value):
+    """Hashes value to 64 bits, unlike hash() the same in every process."""
+    digest = hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def mix64(z):
+    """SplitMix64 finalizer, works on Python ints and uint64 arrays."""
+    if isinstance(z, np.ndarray):
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def position_bits(seed_base, stream, xs, ys):
+    """Returns 64 random bits for each (x, y) of a stream.
+
+    stream is any repr-able value naming the decision, like a layer's protos.
+    """
+    key = mix64(((seed_base or 0) * GOLDEN_GAMMA + stable_hash(stream)) & MASK64)
+    shape = np.broadcast_shapes(np.shape(xs), np.shape(ys))
+    # Works on 1-d arrays, NumPy only wraps uint64 overflow silently for arrays
+    xs = np.broadcast_to(xs, shape).astype(np.int64).astype(np.uint64).ravel()
+    ys = np.broadcast_to(ys, shape).astype(np.int64).astype(np.uint64).ravel()
+    counter = (xs << np.uint64(32)) ^ (ys & np.uint64(0xFFFFFFFF))
+    bits = mix64(np.full_like(counter, key) + counter * np.uint64(GOLDEN_GAMMA))
+    return bits.reshape(shape)
+
+
+def position_random(seed_base, stream, xs, ys):
+    """Returns a uniform float in [0, 1) for each (x, y) of a stream."""
+    bits = position_bits(seed_base, stream, xs, ys)
+    return (bits >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def position_choice(seed_base, stream, xs, ys, count):
+    """Returns a uniform index in [0, count) for each (x, y) of a stream."""
+    bits = position_bits(seed_base, stream, xs, ys) >> np.uint64(32)
+    return ((bits * np.uint64(count)) >> np.uint64(32)).astype(np.int64)
+
+
+# -----------------------------------------------------------------------------
+# Noise sampling
+# -----------------------------------------------------------------------------
+# Layer config keys and the FastNoiseLite attribute each one sets.
+NOISE_SETTINGS = (
+    ("noise_type", "noise_type"),
+    ("octaves", "fractal_octaves"),
+    ("frequency", "frequency"),
+    ("fractal_type", "fractal_type"),
+    ("cellular_distance_function", "cellular_distance_function"),
+    ("cellular_return_type", "cellular_return_type"),
+    ("cellular_jitter", "cellular_jitter"),
+    ("fractal_lacunarity", "fractal_lacunarity"),
+)
+
+
+def layer_seed(seed_base, seed_key):
+    """Derives the noise seed of a layer from the map seed and its seed_key.
+
+    Uses stable_hash, so a seed gives the same map in every run.
+    """
+    return (seed_base + stable_hash(seed_key)) % (2**31)
+
+
+def make_noise(config, seed=None):
+    """Creates a FastNoiseLite configured from a layer (or modulation) config."""
+    noise = FastNoiseLite()
+    for key, attribute in NOISE_SETTINGS:
+        if key in config:
+            setattr(noise, attribute, config[key])
+    if seed is not None:
+        noise.seed = seed
+    return noise
+
+
+def sample_noise_grid(noise, width, height, x_offset=0, y_offset=0):
+    """Evaluates the noise over a whole grid in one call.
+
+    Element [y, x] holds the raw float32 value at (x + x_offset, y + y_offset),
+    identical to what noise.get_noise would return for that coordinate.
+    Layers compare these fields through noise_above, see there.
+    """
+    ys, xs = np.mgrid[y_offset : y_offset + height, x_offset : x_offset + width]
+    coords = np.stack((xs.ravel(), ys.ravel())).astype(np.float32)
+    count_noise_samples(width * height)
+    return noise.gen_from_coords(coords).reshape(height, width)
+
+
+def normalised(raw):
+    """Maps raw noise into [0, 1], in float64 like get_noise's Python floats."""
+    return (np.asarray(raw, dtype=np.float64) + 1) / 2
+
+
+def float32_order(value):
+    """Maps a float32 to an integer with the same order, for bisecting floats."""
+    bits = int(np.float32(value).view(np.int32))
+    return bits if bits >= 0 else -(bits & 0x7FFFFFFF)
+
+
+def float32_at(order):
+    """Inverse of float32_order."""
+    bits = order if order >= 0 else -order | 0x80000000
+    return np.uint32(bits).view(np.float32)
+
+
+@functools.lru_cache(maxsize=256)
+def raw_threshold(threshold):
+    """Returns the smallest raw float32 noise whose normalised value > threshold.
+
+    normalised is monotonic, so comparing a raw float32 field against this
+    gives exactly the same tiles as comparing the float64 normalised field,
+    without widening the field. Found by bisecting all float32 values.
+    """
+    low, high = float32_order(-np.inf), float32_order(np.inf)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if normalised(float32_at(middle)) > threshold:
+            high = middle
+        else:
+            low = middle
+    return float32_at(high)
+
+
+def noise_above(raw, threshold):
+    """Marks where raw noise, once normalised, is above threshold."""
+    return raw >= raw_threshold(threshold)
+
+
+def noise_key(config, seed=None):
+    """Returns a hashable key of the noise settings that affect the sampled values.
+
+    Settings the configured noise type or fractal type ignore are left out, so
+    layers that only differ in those share the same key.
+    """
+    noise = make_noise(config, seed)
+    settings = {attribute: getattr(noise, attribute) for _, attribute in NOISE_SETTINGS}
+    if settings["noise_type"] != NoiseType.NoiseType_Cellular:
+        del settings["cellular_distance_function"]
+        del settings["cellular_return_type"]
+        del settings["cellular_jitter"]
+    if settings["fractal_type"] == FractalType.FractalType_None:
+        del settings["fractal_octaves"]
+        del settings["fractal_lacunarity"]
+    elif settings["fractal_octaves"] <= 1:
+        del settings["fractal_lacunarity"]
+    settings["seed"] = noise.seed
+    return tuple(
+        (key, getattr(value, "name", value)) for key, value in settings.items()
+    )
+
+
+def trim_cache_dir(cache_dir, max_bytes, suffix):
+    """Deletes the oldest files ending in suffix until cache_dir fits max_bytes."""
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(suffix):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # Still open in another process
+        total -= size
+
+
+class NoiseFieldCache:
+    """Memoizes the noise fields of one generation run.
+
+    Fields are sampled once over the full width x height of the run and keyed
+    by noise_key, so layers with identical noise (like the river layers that
+    share "river_noise") reuse the same field across the tile, entity and decal
+    stages. Smaller requests are served as views from the top left corner.
+    The least recently used fields are evicted above max_bytes.
+
+    With cache_dir set, fields are also stored there as .npy files and loaded
+    memory-mapped by later runs with the same seed and map size. The directory
+    is trimmed to cache_dir_bytes, dropping the least recently used files,
+    when the cache is created and after every field stored.
+
+    Missing fields are sampled with sampler(config, seed) when one is given
+    (see StripeNoiseSampler), otherwise with sample_noise_grid.
+    """
+
+    def __init__(
+        self,
+        width,
+        height,
+        max_bytes=256 * 1024**2,
+        cache_dir=None,
+        cache_dir_bytes=1024**3,
+        sampler=None,
+    ):
+        self.width = width
+        self.height = height
+        self.sampler = sampler
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.cache_dir_bytes = cache_dir_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._fields = OrderedDict()
+        self._bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Applies a lowered size limit even to runs that only hit
+            trim_cache_dir(cache_dir, cache_dir_bytes, ".npy")
+
+    def field(self, config, seed, width, height):
+        """Returns the read-only raw field for config and seed."""
+        if width > self.width or height > self.height:
+            raise ValueError(
+                f"Requested {width}x{height} field exceeds the cached "
+                f"{self.width}x{self.height} area"
+            )
+        key = noise_key(config, seed)
+        field = self._fields.get(key)
+        if field is not None:
+            self._fields.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            field = self._load_or_sample(key, config, seed)
+            field.flags.writeable = False
+            self._store(key, field)
+        return field[:height, :width]
+
+    def _sample(self, config, seed):
+        if self.sampler is not None:
+            return self.sampler(config, seed)
+        return sample_noise_grid(make_noise(config, seed), self.width, self.height)
+
+    def _load_or_sample(self, key, config, seed):
+        if self.cache_dir is None:
+            return self._sample(config, seed)
+
+        digest = hashlib.sha1(repr((key, self.width, self.height)).encode()).hexdigest()
+        path = os.path.join(self.cache_dir, f"{digest}.npy")
+        try:
+            field = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            field = None
+        if (
+            field is not None
+            and field.shape == (self.height, self.width)
+            and field.dtype == np.float32
+        ):
+            os.utime(path)  # Marks the file as recently used
+            self.disk_hits += 1
+            return field
+
+        field = self._sample(config, seed)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as outfile:
+            np.save(outfile, field)
+        os.replace(temp_path, path)
+        trim_cache_dir(self.cache_dir, self.cache_dir_bytes, ".npy")
+        return field
+
+    def _store(self, key, field):
+        if field.nbytes > self.max_bytes:
+            return
+        self._fields[key] = field
+        self._bytes += field.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._fields.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+
+def layer_noise_field(config, seed, width, height, noise_cache=None):
+    """Returns the raw noise field of a layer, through noise_cache if given."""
+    if noise_cache is None:
+        return sample_noise_grid(make_noise(config, seed), width, height)
+    return noise_cache.field(config, seed, width, height)
+
+
+def noise_field_source(noise_cache, width, height):
+    """Returns layer_field(config, seed) over the top left width x height area."""
+
+    def layer_field(config, seed):
+        return layer_noise_field(config, seed, width, height, noise_cache)
+
+    return layer_field
+
+
+def window_noise_source(x_start, y_start, width, height):
+    """Returns layer_field(config, seed) over a window of a map.
+
+    Noise only depends on the coordinate, so the window matches the same area
+    of a full field. Layers sharing a noise_key share the sampled window.
+    """
+    fields = {}
+
+    def layer_field(config, seed):
+        key = noise_key(config, seed)
+        if key not in fields:
+            fields[key] = sample_noise_grid(
+                make_noise(config, seed), width, height, x_start, y_start
+            )
+        return fields[key]
+
+    return layer_field
+
+
+def sample_noise_points(noise, xs, ys):
+    """Evaluates the noise at the given coordinates only, normalised into [0, 1]."""
+    coords = np.stack((xs, ys)).astype(np.float32)
+    count_noise_samples(coords.shape[1])
+    return normalised(noise.gen_from_coords(coords))
+
+
+# Shared buffer of a StripeNoiseSampler, attached once per worker process
+stripe_buffer = None
+
+
+def attach_stripe_buffer(name, width, height):
+    """Process pool initializer, maps the sampler's shared buffer."""
+    global stripe_buffer
+    shared = shared_memory.SharedMemory(name=name)
+    stripe_buffer = (shared, np.ndarray((height, width), np.float32, shared.buf))
+
+
+def sample_noise_stripe(task):
+    """Writes the raw noise of rows y_start:y_end into the shared buffer."""
+    settings, seed, y_start, y_end = task
+    _, buffer = stripe_buffer
+    width = buffer.shape[1]
+    ys, xs = np.mgrid[y_start:y_end, 0:width]
+    coords = np.stack((xs.ravel(), ys.ravel())).astype(np.float32)
+    noise = make_noise(settings, seed)
+    buffer[y_start:y_end] = noise.gen_from_coords(coords).reshape(-1, width)
+
+
+class StripeNoiseSampler:
+    """Samples full noise fields across a process pool.
+
+    Each field is split into chunk-aligned stripes of rows that the workers
+    write into one shared memory buffer, so no field is pickled between
+    processes. Noise only depends on the coordinate, so the fields are
+    identical to sample_noise_grid whatever the worker count.
+    """
+
+    def __init__(self, width, height, workers, chunk_size=16):
+        self.width = width
+        self.height = height
+        self._shared = shared_memory.SharedMemory(
+            create=True, size=max(1, width * height * 4)
+        )
+        self._buffer = np.ndarray((height, width), np.float32, self._shared.buf)
+        self._pool = multiprocessing.Pool(
+            workers,
+            initializer=attach_stripe_buffer,
+            initargs=(self._shared.name, width, height),
+        )
+        # A few stripes per worker keeps them busy when rows cost differently
+        chunk_rows = -(-height // chunk_size)
+        rows = chunk_size * max(1, -(-chunk_rows // (workers * 4)))
+        self.stripes = [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+    def __call__(self, config, seed=None):
+        """Returns the raw field of config over the sampler's grid."""
+        settings = {key: config[key] for key, _ in NOISE_SETTINGS if key in config}
+        self._pool.map(
+            sample_noise_stripe,
+            [(settings, seed, y_start, y_end) for y_start, y_end in self.stripes],
+        )
+        count_noise_samples(self.width * self.height)
+        return self._buffer.copy()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._buffer = None
+        self._shared.close()
+        self._shared.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 # -----------------------------------------------------------------------------
 # Generating a TileMap with multiple layers
 # -----------------------------------------------------------------------------
-def generate_tile_map(width, height, biome_tile_layers, seed_base=None):
+def generate_tile_map(
+    width, height, biome_tile_layers, seed_base=None, noise_cache=None
+):
     """Generates the tile_map based on the layers defined in biome_tile_layers."""
-    tile_map = np.full((height, width), TILEMAP_REVERSE["FloorDirt"], dtype=np.int32)
+    tile_map = np.full((height, width), TILEMAP_REVERSE["FloorDirt"], dtype=TILE_DTYPE)
+
+    sorted_layers = ordered_layers(biome_tile_layers, "BiomeTileLayer")
 
-    # Orders the layers by priority (largest to smallest)
-    sorted_layers = sorted(
-        biome_tile_layers, key=lambda layer: layer.get("priority", 1)
+    counts = place_tile_layers(
+        tile_map,
+        sorted_layers,
+        seed_base,
+        noise_field_source(noise_cache, width, height),
     )
+    for layer, count in zip(sorted_layers, counts):
+        print(f"Layer {layer['tile_type']}: {count} tiles placed")
+    return tile_map
+
+
+def place_tile_layers(tiles, sorted_layers, seed_base, layer_field, origin=(0, 0)):
+    """Places the tile layers on a window of a map, in place.
 
+    tiles is the window whose top left tile is at origin (x, y) on the map,
+    and layer_field(config, seed) returns the noise field over it. Returns the
+    number of tiles each layer placed.
+    """
+    x_start, y_start = origin
+    counts = []
     for layer in sorted_layers:
-        noise = FastNoiseLite()
-        noise.noise_type = layer["noise_type"]
-        noise.fractal_octaves = layer["octaves"]
-        noise.frequency = layer["frequency"]
-        noise.fractal_type = layer["fractal_type"]
-
-        if "cellular_distance_function" in layer:
-            noise.cellular_distance_function = layer["cellular_distance_function"]
-        if "cellular_return_type" in layer:
-            noise.cellular_return_type = layer["cellular_return_type"]
-        if "cellular_jitter" in layer:
-            noise.cellular_jitter = layer["cellular_jitter"]
-        if "fractal_lacunarity" in layer:
-            noise.fractal_lacunarity = layer["fractal_lacunarity"]
-
-        if seed_base is not None:
+        with profile_layer(layer) as record:
             seed_key = layer.get("seed_key", layer["tile_type"])
-            noise.seed = (seed_base + hash(seed_key)) % (2**31)
-
-        # Modulation config, if present
-        mod_noise = None
-        if "modulation" in layer:
-            mod_config = layer["modulation"]
-            mod_noise = FastNoiseLite()
-            mod_noise.noise_type = mod_config.get(
-                "noise_type", NoiseType.NoiseType_OpenSimplex2
-            )
-            if "cellular_distance_function" in mod_config:
-                mod_noise.cellular_distance_function = mod_config[
-                    "cellular_distance_function"
-                ]
-            if "cellular_return_type" in mod_config:
-                mod_noise.cellular_return_type = mod_config["cellular_return_type"]
-            if "cellular_jitter" in mod_config:
-                mod_noise.cellular_jitter = mod_config["cellular_jitter"]
-            if "fractal_lacunarity" in mod_config:
-                mod_noise.fractal_lacunarity = mod_config["fractal_lacunarity"]
-            mod_noise.frequency = mod_config.get("frequency", 0.010)
-            mod_noise.seed = (seed_base + hash(seed_key + "_mod")) % (2**31)
-            threshold_min = mod_config.get("threshold_min", 0.4)
-            threshold_max = mod_config.get("threshold_max", 0.6)
-
-        count = 0
-        dont_overwrite = [TILEMAP_REVERSE[t] for t in layer.get("dontOverwrite", [])]
-
-        for y in range(height):
-            for x in range(width):
-                noise_value = noise.get_noise(x, y)
-                noise_value = (noise_value + 1) / 2  # Normalise into [0, 1]
-
-                place_tile = False
-                if mod_noise:
-                    mod_value = mod_noise.get_noise(x, y)
-                    mod_value = (mod_value + 1) / 2
-                    if noise_value > layer["threshold"]:
-                        if mod_value > threshold_max:
-                            place_tile = True
-                        elif mod_value > threshold_min:
-                            probability = (mod_value - threshold_min) / (
-                                threshold_max - threshold_min
-                            )
-                            place_tile = random.random() < probability
-                else:
-                    if noise_value > layer["threshold"]:
-                        place_tile = True
-
-                if place_tile:
-                    current_tile = tile_map[y, x]
-                    if current_tile not in dont_overwrite:
-                        if (
-                            layer.get("overwrite", True)
-                            or current_tile == TILEMAP_REVERSE["Space"]
-                        ):
-                            tile_map[y, x] = TILEMAP_REVERSE[layer["tile_type"]]
-                            count += 1
+            seed = layer_seed(seed_base, seed_key) if seed_base is not None else None
+            noise_field = layer_field(layer, seed)
+
+            # Modulation config, if present
+            mod_field = None
+            if "modulation" in layer:
+                mod_config = layer["modulation"]
+                mod_seed = (
+                    layer_seed(seed_base, seed_key + "_mod")
+                    if seed_base is not None
+                    else None
+                )
+                mod_field = layer_field(mod_config, mod_seed)
+                threshold_min = mod_config.get("threshold_min", 0.4)
+                threshold_max = mod_config.get("threshold_max", 0.6)
+
+            place = noise_above(noise_field, layer["threshold"])
+            if mod_field is not None:
+                # Above threshold_max the tile is always placed, between the two
+                # thresholds with a probability that ramps up linearly.
+                above_max = noise_above(mod_field, threshold_max)
+                ramp = place & noise_above(mod_field, threshold_min) & ~above_max
+                probability = (normalised(mod_field[ramp]) - threshold_min) / (
+                    threshold_max - threshold_min
+                )
+                place &= above_max
+                ys, xs = np.nonzero(ramp)
+                place[ramp] = (
+                    position_random(
+                        seed_base, ("modulation", seed_key), xs + x_start, ys + y_start
+                    )
+                    < probability
+                )
 
-        print(f"Layer {layer['tile_type']}: {count} tiles placed")
-    return tile_map
+            dont_overwrite = [
+                TILEMAP_REVERSE[t] for t in layer.get("dontOverwrite", [])
+            ]
+            place &= ~np.isin(tiles, dont_overwrite)
+            if not layer.get("overwrite", True):
+                place &= tiles == TILEMAP_REVERSE["Space"]
+
+            tiles[place] = TILEMAP_REVERSE[layer["tile_type"]]
+            counts.append(int(np.count_nonzero(place)))
+            record["placed"] += counts[-1]
+    return counts
 
 
 # -----------------------------------------------------------------------------
 # Entity generation
 # -----------------------------------------------------------------------------
-global_uid = 3
+class EntityStore:
+    """Transform-only entities kept as columns of proto id, uid, x and y.
+
+    UIDs are handed out in ranges by reserve_uids, after the map (1) and grid
+    (2) entities. groups() lists the protos in order of first appearance,
+    each with its entities in the order they were added; the YAML of the
+    entities is only rendered when the map is written.
+    """
+
+    def __init__(self, first_uid=3):
+        self.next_uid = first_uid
+        self.protos = []
+        self._proto_ids = {}
+        self._blocks = []
+
+    def reserve_uids(self, count):
+        """Reserves count consecutive UIDs and returns the first one."""
+        start = self.next_uid
+        self.next_uid += count
+        return start
+
+    def proto_id(self, proto):
+        """Returns the id of proto, registering it as the next group if new."""
+        if proto not in self._proto_ids:
+            self._proto_ids[proto] = len(self.protos)
+            self.protos.append(proto)
+        return self._proto_ids[proto]
+
+    def add(self, proto, uids, xs, ys):
+        """Adds entities of proto at tiles (xs, ys)."""
+        uids = np.asarray(uids, dtype=np.int64)
+        self._blocks.append(
+            (
+                np.full(uids.size, self.proto_id(proto), dtype=np.int32),
+                uids,
+                np.asarray(xs, dtype=np.int32),
+                np.asarray(ys, dtype=np.int32),
+            )
+        )
+
+    def __len__(self):
+        return sum(block[0].size for block in self._blocks)
+
+    def counts(self):
+        """Returns the number of entities of each proto, by proto id."""
+        counts = np.zeros(len(self.protos), dtype=np.int64)
+        for proto_ids, _, _, _ in self._blocks:
+            counts += np.bincount(proto_ids, minlength=len(self.protos))
+        return counts
+
+    def positions(self, protos):
+        """Returns the (xs, ys) of the entities of any of protos."""
+        proto_ids = [
+            self._proto_ids[proto] for proto in protos if proto in self._proto_ids
+        ]
+        xs, ys = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.int32)]
+        for block_ids, _, block_xs, block_ys in self._blocks:
+            picked = np.isin(block_ids, proto_ids)
+            xs.append(block_xs[picked])
+            ys.append(block_ys[picked])
+        return np.concatenate(xs), np.concatenate(ys)
+
+    def groups(self):
+        """Returns one {"proto", "uids", "xs", "ys"} entity group per proto."""
+        if not self._blocks:
+            columns = [np.empty(0, dtype=np.int32)] * 4
+        else:
+            columns = [np.concatenate(column) for column in zip(*self._blocks)]
+        proto_ids, uids, xs, ys = columns
+        order = np.argsort(proto_ids, kind="stable")
+        bounds = np.cumsum(np.bincount(proto_ids, minlength=len(self.protos)))
+        groups = []
+        start = 0
+        for proto, stop in zip(self.protos, bounds.tolist()):
+            picked = order[start:stop]
+            groups.append(
+                {
+                    "proto": proto,
+                    "uids": uids[picked],
+                    "xs": xs[picked],
+                    "ys": ys[picked],
+                }
+            )
+            start = stop
+        return groups
+
 
+def resolve_entity_layers(
+    tiles, layers, seed_base, layer_field, origin=(0, 0), map_shape=None
+):
+    """Places priority-ordered entity layers against an occupancy bitmap.
+
+    tiles is a window of the map whose top left tile is at origin (x, y), the
+    whole map unless map_shape says otherwise, and layer_field(config, seed)
+    returns the noise field over it. Returns one (entity_protos, xs, ys,
+    choices) tuple per layer, with the map positions in row-major order and
+    choices indexing into entity_protos.
+    """
+    h, w = tiles.shape
+    x_start, y_start = origin
+    if map_shape is None:
+        map_shape = tiles.shape
+    # The border is reserved for the indestructible walls
+    occupied = border_mask(*map_shape, y_start, y_start + h, x_start, x_start + w)
+
+    placements = []
+    for layer in layers:
+        with profile_layer(layer) as record:
+            # Get entity_protos list
+            entity_protos = layer["entity_protos"]
+            if isinstance(entity_protos, str):  # If its a string, turns it into a list
+                entity_protos = [entity_protos]
+
+            # Set layer noise
+            seed = None
+            if seed_base is not None:
+                # Uses "seed_key" if available, if not uses a hash based on entity_protos
+                seed_key = layer.get("seed_key", tuple(entity_protos))
+                seed = layer_seed(seed_base, seed_key)
+            noise_field = layer_field(layer, seed)
+
+            place = noise_above(noise_field, layer["threshold"])
+            place &= ~occupied
+            place &= tile_condition_mask(tiles, layer["tile_condition"])
+            occupied |= place
+
+            ys, xs = np.nonzero(place)
+            record["placed"] += xs.size
+            xs += x_start
+            ys += y_start
+            choices = position_choice(
+                seed_base,
+                ("entities", tuple(entity_protos)),
+                xs,
+                ys,
+                len(entity_protos),
+            )
+            placements.append((entity_protos, xs, ys, choices))
+    return placements
 
-def next_uid():
-    """Generates an unique UID for each entity."""
-    global global_uid
-    uid = global_uid
-    global_uid += 1
-    return uid
 
+def generate_dynamic_entities(
+    tile_map, biome_entity_layers, seed_base=None, noise_cache=None, store=None
+):
+    """Generates dynamic entities based on the entity layers, respecting priorities.
 
-def generate_dynamic_entities(tile_map, biome_entity_layers, seed_base=None):
-    """Generates dynamic entities based on the entity layers, respecting priorities."""
-    groups = {}
-    entity_count = {}  # Count entities by proto
+    The entities are added to store, a new EntityStore unless given, which is
+    returned.
+    """
+    if store is None:
+        store = EntityStore()
     h, w = tile_map.shape
-    occupied_positions = set()  # Set to trace occupied positions
 
-    # Order layers by priority. Highest first
-    sorted_layers = sorted(
-        biome_entity_layers, key=lambda layer: layer.get("priority", 0), reverse=True
-    )
+    sorted_layers = ordered_layers(biome_entity_layers, "BiomeEntityLayer")
 
-    for layer in sorted_layers:
-        # Get entity_protos list
-        entity_protos = layer["entity_protos"]
-        if isinstance(entity_protos, str):  # If its a string, turns it into a list
-            entity_protos = [entity_protos]
-
-        # Set layer noise
-        noise = FastNoiseLite()
-        noise.noise_type = layer["noise_type"]
-        noise.fractal_octaves = layer["octaves"]
-        noise.frequency = layer["frequency"]
-        noise.fractal_type = layer["fractal_type"]
-
-        if "cellular_distance_function" in layer:
-            noise.cellular_distance_function = layer["cellular_distance_function"]
-        if "cellular_return_type" in layer:
-            noise.cellular_return_type = layer["cellular_return_type"]
-        if "cellular_jitter" in layer:
-            noise.cellular_jitter = layer["cellular_jitter"]
-        if "fractal_lacunarity" in layer:
-            noise.fractal_lacunarity = layer["fractal_lacunarity"]
-
-        if seed_base is not None:
-            # Uses "seed_key" if available, if not uses a hash based on entity_protos
-            seed_key = layer.get("seed_key", tuple(entity_protos))
-            noise.seed = (seed_base + hash(seed_key)) % (2**31)
-
-        for y in range(h):
-            for x in range(w):
-                if x == 0 or x == w - 1 or y == 0 or y == h - 1:
-                    continue
-                if (x, y) in occupied_positions:
-                    continue
-                tile_val = tile_map[y, x]
-                noise_value = noise.get_noise(x, y)
-                noise_value = (noise_value + 1) / 2  # Normalise into [0, 1]
-                if noise_value > layer["threshold"] and layer["tile_condition"](
-                    tile_val
-                ):
-                    # Chooses randomly a proto
-                    proto = random.choice(entity_protos)
-                    if proto not in groups:
-                        groups[proto] = []
-                    groups[proto].append(
-                        {
-                            "uid": next_uid(),
-                            "components": [
-                                {"type": "Transform", "parent": 2, "pos": f"{x},{y}"}
-                            ],
-                        }
-                    )
-                    occupied_positions.add((x, y))
-                    # Counts entities by proto
-                    entity_count[proto] = entity_count.get(proto, 0) + 1
+    for entity_protos, xs, ys, choices in resolve_entity_layers(
+        tile_map, sorted_layers, seed_base, noise_field_source(noise_cache, w, h)
+    ):
+        uids = store.reserve_uids(xs.size) + np.arange(xs.size)
+        for choice, picked in iter_choice_groups(choices):
+            store.add(entity_protos[choice], uids[picked], xs[picked], ys[picked])
 
     # Surrounding undestructible walls
-    groups["WallRockIndestructible"] = []
-    for y in range(h):
-        for x in range(w):
-            if x == 0 or x == w - 1 or y == 0 or y == h - 1:
-                groups["WallRockIndestructible"].append(
-                    {
-                        "uid": next_uid(),
-                        "components": [
-                            {"type": "Transform", "parent": 2, "pos": f"{x},{y}"}
-                        ],
-                    }
-                )
-                # Count undestructible walls
-                entity_count["WallRockIndestructible"] = (
-                    entity_count.get("WallRockIndestructible", 0) + 1
-                )
-
-    dynamic_groups = [
-        {"proto": proto, "entities": ents} for proto, ents in groups.items()
-    ]
+    ys, xs = np.nonzero(border_mask(h, w))
+    uids = store.reserve_uids(xs.size) + np.arange(xs.size)
+    store.add("WallRockIndestructible", uids, xs, ys)
 
     # Print generated protos
-    for proto, count in entity_count.items():
+    for proto, count in zip(store.protos, store.counts().tolist()):
         print(f"Generated {count} amount of {proto}")
 
-    return dynamic_groups
+    return store
 
 
-def generate_decals(tile_map, biome_decal_layers, seed_base=None, chunk_size=16):
-    """Generate decals using biome_decal_layers and log the count of each decal type."""
+def generate_decals(
+    tile_map, biome_decal_layers, seed_base=None, chunk_size=16, noise_cache=None
+):
+    """Generate decals using biome_decal_layers, returns them by decal id."""
     decals_by_id = {}
     h, w = tile_map.shape
-    occupied_tiles = set()
-    decal_count = {}
-
-    for layer in biome_decal_layers:
-        noise = FastNoiseLite()
-        noise.noise_type = layer["noise_type"]
-        noise.fractal_octaves = layer["octaves"]
-        noise.frequency = layer["frequency"]
-        noise.fractal_type = layer["fractal_type"]
-
-        if seed_base is not None:
-            seed_key = layer.get(
-                "seed_key",
-                (
-                    tuple(layer["decal_id"])
-                    if isinstance(layer["decal_id"], list)
-                    else layer["decal_id"]
-                ),
-            )
-            noise.seed = (seed_base + hash(seed_key)) % (2**31)
 
-        decal_ids = (
-            layer["decal_id"]
-            if isinstance(layer["decal_id"], list)
-            else [layer["decal_id"]]
+    for decal_ids, color, choices, pos_x, pos_y in resolve_decal_layers(
+        tile_map, biome_decal_layers, seed_base, noise_field_source(noise_cache, w, h)
+    ):
+        positions = np.array(
+            [f"{x:.7f},{y:.7f}" for x, y in zip(pos_x.tolist(), pos_y.tolist())],
+            dtype=object,
         )
-
-        for y in range(h):
-            for x in range(w):
-                if x == 0 or x == w - 1 or y == 0 or y == h - 1:
-                    continue
-                if (x, y) in occupied_tiles:
-                    continue
-                tile_val = tile_map[y, x]
-                noise_value = noise.get_noise(x, y)
-                noise_value = (noise_value + 1) / 2
-                if noise_value > layer["threshold"] and layer["tile_condition"](
-                    tile_val
-                ):
-                    chosen_decal_id = random.choice(decal_ids)
-                    if chosen_decal_id not in decals_by_id:
-                        decals_by_id[chosen_decal_id] = []
-                    # Small random offset for decals
-                    offset_x = (
-                        noise.get_noise(x + 1000, y + 1000) + 1
-                    ) / 4 - 0.25  # Between -0.25 and 0.25
-                    offset_y = (
-                        noise.get_noise(x + 2000, y + 2000) + 1
-                    ) / 4 - 0.25  # Between -0.25 and 0.25
-                    pos_x = x + offset_x
-                    pos_y = y + offset_y
-                    pos_str = f"{pos_x:.7f},{pos_y:.7f}"
-                    decals_by_id[chosen_decal_id].append(
-                        {"color": layer.get("color", "#FFFFFFFF"), "position": pos_str}
-                    )
-                    occupied_tiles.add((x, y))
-                    decal_count[chosen_decal_id] = (
-                        decal_count.get(chosen_decal_id, 0) + 1
-                    )
+        for choice, picked in iter_choice_groups(choices):
+            chosen_decal_id = decal_ids[choice]
+            decals_by_id.setdefault(chosen_decal_id, []).extend(
+                {"color": color, "position": pos_str} for pos_str in positions[picked]
+            )
 
     return decals_by_id
 
 
+def resolve_decal_layers(
+    tiles, layers, seed_base, layer_field, origin=(0, 0), map_shape=None
+):
+    """Places decal layers against an occupancy bitmap, like resolve_entity_layers.
+
+    Returns one (decal_ids, color, choices, pos_x, pos_y) tuple per layer,
+    with the positions in row-major order.
+    """
+    h, w = tiles.shape
+    x_start, y_start = origin
+    if map_shape is None:
+        map_shape = tiles.shape
+    occupied = border_mask(*map_shape, y_start, y_start + h, x_start, x_start + w)
+
+    placements = []
+    for layer in layers:
+        with profile_layer(layer) as record:
+            seed = None
+            if seed_base is not None:
+                seed_key = layer.get(
+                    "seed_key",
+                    (
+                        tuple(layer["decal_id"])
+                        if isinstance(layer["decal_id"], list)
+                        else layer["decal_id"]
+                    ),
+                )
+                seed = layer_seed(seed_base, seed_key)
+            noise = make_noise(layer, seed)
+            noise_field = layer_field(layer, seed)
+
+            decal_ids = (
+                layer["decal_id"]
+                if isinstance(layer["decal_id"], list)
+                else [layer["decal_id"]]
+            )
+
+            place = noise_above(noise_field, layer["threshold"])
+            place &= ~occupied
+            place &= tile_condition_mask(tiles, layer["tile_condition"])
+            occupied |= place
+            ys, xs = np.nonzero(place)
+            record["placed"] += xs.size
+            xs += x_start
+            ys += y_start
+            choices = position_choice(
+                seed_base, ("decals", tuple(decal_ids)), xs, ys, len(decal_ids)
+            )
+
+            # Small random offset for decals, between -0.25 and 0.25
+            pos_x = xs + (sample_noise_points(noise, xs + 1000, ys + 1000) / 2 - 0.25)
+            pos_y = ys + (sample_noise_points(noise, xs + 2000, ys + 2000) / 2 - 0.25)
+            color = layer.get("color", "#FFFFFFFF")
+            placements.append((decal_ids, color, choices, pos_x, pos_y))
+    return placements
+
+
 # Defines uniqueMixes for the atmosphere
 unique_mixes = [
     {
@@ -357,16 +1062,24 @@ unique_mixes = [
 
 def generate_atmosphere_tiles(width, height, chunk_size):
     """Generates the atmos tiles based on the map size."""
+    tiles = {}
+    for row in atmosphere_tile_rows(width, height, chunk_size):
+        tiles.update(row)
+    return tiles
+
+
+def atmosphere_tile_rows(width, height, chunk_size):
+    """Yields the atmos tiles one row of atmos chunks at a time."""
     max_x = (width + chunk_size - 1) // chunk_size - 1
     max_y = (height + chunk_size - 1) // chunk_size - 1
-    tiles = {}
     for y in range(-1, max_y + 1):
+        row = {}
         for x in range(-1, max_x + 1):
             if x == -1 or x == max_x or y == -1 or y == max_y:
-                tiles[f"{x},{y}"] = {0: 65535}
+                row[f"{x},{y}"] = {0: 65535}
             else:
-                tiles[f"{x},{y}"] = {1: 65535}
-    return tiles
+                row[f"{x},{y}"] = {1: 65535}
+        yield row
 
 
 def generate_main_entities(tile_map, chunk_size=16, decals_by_id=None):
@@ -376,19 +1089,8 @@ def generate_main_entities(tile_map, chunk_size=16, decals_by_id=None):
 
     h, w = tile_map.shape
     chunks = {}
-    for cy in range(0, h, chunk_size):
-        for cx in range(0, w, chunk_size):
-            chunk_key = f"{cx//chunk_size},{cy//chunk_size}"
-            chunk_tiles = tile_map[cy : cy + chunk_size, cx : cx + chunk_size]
-            if chunk_tiles.shape[0] < chunk_size or chunk_tiles.shape[1] < chunk_size:
-                full_chunk = np.zeros((chunk_size, chunk_size), dtype=np.int32)
-                full_chunk[: chunk_tiles.shape[0], : chunk_tiles.shape[1]] = chunk_tiles
-                chunk_tiles = full_chunk
-            chunks[chunk_key] = {
-                "ind": f"{cx//chunk_size},{cy//chunk_size}",
-                "tiles": encode_tiles(chunk_tiles),
-                "version": 6,
-            }
+    for (cx, cy), tiles in encode_chunks(tile_map, chunk_size).items():
+        chunks[f"{cx},{cy}"] = {"ind": f"{cx},{cy}", "tiles": tiles, "version": 6}
 
     atmosphere_chunk_size = 4
     atmosphere_tiles = generate_atmosphere_tiles(w, h, atmosphere_chunk_size)
@@ -411,6 +1113,13 @@ def generate_main_entities(tile_map, chunk_size=16, decals_by_id=None):
     print(f"Total decal nodes generated: {len(decal_nodes)}")
     print(f"Total decals: {global_index}")
 
+    return main_entity_group(
+        chunks, decal_nodes, atmosphere_tiles, atmosphere_chunk_size
+    )
+
+
+def main_entity_group(chunks, decal_nodes, atmosphere_tiles, atmosphere_chunk_size):
+    """Returns the proto-less group holding the map and grid entities."""
     main = {
         "proto": "",
         "entities": [
@@ -497,272 +1206,1479 @@ def generate_main_entities(tile_map, chunk_size=16, decals_by_id=None):
     return main
 
 
-def generate_all_entities(tile_map, chunk_size=16, biome_layers=None, seed_base=None):
-    """Combines tiles, entities and decals."""
-    entities = []
+def generate_all_entities(
+    tile_map,
+    chunk_size=16,
+    biome_layers=None,
+    seed_base=None,
+    noise_cache=None,
+    check_connectivity=False,
+):
+    """Combines tiles, entities and decals.
+
+    Returns a dict of the EntityStore of entities and spawn points as
+    "store", the decals by decal id as "decals" and the entity groups
+    write_map_yaml writes as "entities". With check_connectivity the spawn
+    points are only placed on spawn_area, so they can all walk to each other.
+    """
     if biome_layers is None:
         biome_layers = []
-    biome_tile_layers = [
-        layer for layer in biome_layers if layer["type"] == "BiomeTileLayer"
-    ]
-    biome_entity_layers = [
-        layer for layer in biome_layers if layer["type"] == "BiomeEntityLayer"
-    ]
-    biome_decal_layers = [
-        layer for layer in biome_layers if layer["type"] == "BiomeDecalLayer"
-    ]
 
-    dynamic_groups = generate_dynamic_entities(tile_map, biome_entity_layers, seed_base)
-    decals_by_chunk = generate_decals(
-        tile_map, biome_decal_layers, seed_base, chunk_size
-    )
-    main_entities = generate_main_entities(tile_map, chunk_size, decals_by_chunk)
-    entities.append(main_entities)
-    entities.extend(dynamic_groups)
-    spawn_points = generate_spawn_points(tile_map)
-    entities.extend(spawn_points)
-    return entities
+    with profile_stage("entities"):
+        store = generate_dynamic_entities(
+            tile_map,
+            layers_of_type(biome_layers, "BiomeEntityLayer"),
+            seed_base,
+            noise_cache,
+        )
+    allowed = None
+    if check_connectivity:
+        with profile_stage("connectivity"):
+            allowed = spawn_area(tile_map, store)
+    with profile_stage("spawn_points"):
+        generate_spawn_points(
+            tile_map, seed_base=seed_base, store=store, allowed=allowed
+        )
+    with profile_stage("decals"):
+        decals_by_id = generate_decals(
+            tile_map,
+            layers_of_type(biome_layers, "BiomeDecalLayer"),
+            seed_base,
+            chunk_size,
+            noise_cache,
+        )
+    with profile_stage("main_entities"):
+        main_entities = generate_main_entities(tile_map, chunk_size, decals_by_id)
+    return {
+        "store": store,
+        "decals": decals_by_id,
+        "entities": [main_entities] + store.groups(),
+    }
 
 
 # -----------------------------------------------------------------------------
 # Save YAML
 # -----------------------------------------------------------------------------
-def represent_sound_path_specifier(dumper, data):
-    """Customised representation for the SoundPathSpecifier in the YAML."""
-    for key, value in data.items():
+# The writer below emits the same block-style YAML as
+# yaml.dump(default_flow_style=False, sort_keys=False), but streams it to the
+# file as it goes and writes the many Transform-only entities from a template.
+PLAIN_SCALAR = re.compile(r"[A-Za-z0-9/][A-Za-z0-9_./,+=-]*\Z")
+YAML_RESOLVER = yaml.resolver.Resolver()
+
+TRANSFORM_ENTITY = """\
+  - uid: {uid}
+    components:
+    - type: Transform
+      parent: {parent}
+      pos: {pos}
+"""
+
+
+@functools.lru_cache(maxsize=4096)
+def yaml_string(value):
+    """Formats a string scalar, quoted only when PyYAML would quote it."""
+    if value.isascii() and value.isdigit() and (value == "0" or value[0] != "0"):
+        return f"'{value}'"  # Decimal integers, like the decal indices
+    implicit_tag = YAML_RESOLVER.resolve(yaml.ScalarNode, value, (True, False))
+    if PLAIN_SCALAR.match(value) and implicit_tag == "tag:yaml.org,2002:str":
+        return value
+    text = yaml.dump(value, default_flow_style=False, width=float("inf"))
+    if text.endswith("\n...\n"):  # Document end marker of plain scalars
+        text = text[: -len("...\n")]
+    return text.rstrip("\n")
+
+
+def yaml_scalar(value):
+    """Formats a scalar the way yaml.dump represents it."""
+    if value is None:
+        return "null"
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if value != value:
+            return ".nan"
+        if value in (float("inf"), float("-inf")):
+            return ".inf" if value > 0 else "-.inf"
+        text = repr(value).lower()
+        if "." not in text and "e" in text:
+            text = text.replace("e", ".0e", 1)
+        return text
+    return yaml_string(value)
+
+
+class RenderedBlock(str):
+    """YAML text rendered ahead of time, written as the block of a mapping key."""
+
+
+class StreamedBlock:
+    """YAML text rendered piece by piece as it is written, like RenderedBlock.
+
+    For blocks too large to hold in memory; pieces(write) writes the text.
+    """
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+
+def sound_path_tag(mapping):
+    """Returns (tag, mapping) for {"!type:...": {"path": ...}} nodes, else None."""
+    for key, value in mapping.items():
         if isinstance(key, str) and key.startswith("!type:"):
-            tag = key
             if isinstance(value, dict) and "path" in value:
-                return dumper.represent_mapping(tag, value)
-    return dumper.represent_dict(data)
+                return key, value
+    return None
+
+
+def write_yaml_value(write, value, indent):
+    """Writes the value of a mapping key whose line is already started."""
+    if isinstance(value, RenderedBlock):
+        write("\n")
+        write(value)
+    elif isinstance(value, StreamedBlock):
+        write("\n")
+        value.pieces(write)
+    elif isinstance(value, dict):
+        tagged = sound_path_tag(value)
+        if tagged is not None:
+            tag, value = tagged
+            write(f" {tag}")
+        if not value:
+            write(" {}\n")
+            return
+        write("\n")
+        write_yaml_mapping(write, value, indent + 2)
+    elif isinstance(value, list):
+        if not value:
+            write(" []\n")
+            return
+        # Sequences in mappings are not indented, like PyYAML does
+        write("\n")
+        write_yaml_sequence(write, value, indent)
+    else:
+        write(f" {yaml_scalar(value)}\n")
+
+
+def write_yaml_mapping(write, mapping, indent, first_prefix=None):
+    """Writes a block mapping; first_prefix replaces the first key's indent."""
+    prefix = " " * indent if first_prefix is None else first_prefix
+    for key, value in mapping.items():
+        write(f"{prefix}{yaml_scalar(key)}:")
+        write_yaml_value(write, value, indent)
+        prefix = " " * indent
+
+
+def write_yaml_sequence(write, sequence, indent):
+    """Writes a block sequence with its dashes at indent."""
+    dash = " " * indent + "- "
+    for item in sequence:
+        if isinstance(item, dict) and item and sound_path_tag(item) is None:
+            write_yaml_mapping(write, item, indent + 2, first_prefix=dash)
+        elif isinstance(item, (dict, list)) and item:
+            raise ValueError("Nested sequences and tags in sequences are not supported")
+        elif isinstance(item, dict):
+            write(f"{dash}{{}}\n")
+        elif isinstance(item, list):
+            write(f"{dash}[]\n")
+        else:
+            write(f"{dash}{yaml_scalar(item)}\n")
+
+
+def is_transform_only(entity):
+    """Checks whether an entity only has a parented Transform component."""
+    if entity.keys() != {"uid", "components"} or len(entity["components"]) != 1:
+        return False
+    component = entity["components"][0]
+    return component.keys() == {"type", "parent", "pos"} and (
+        component["type"] == "Transform"
+        and type(component["parent"]) is int
+        and isinstance(component["pos"], str)
+        and PLAIN_SCALAR.match(component["pos"]) is not None
+        and "," in component["pos"]
+    )
 
 
-def save_map_to_yaml(
-    tile_map,
-    biome_layers,
-    output_dir,
-    filename="output.yml",
-    chunk_size=16,
-    seed_base=None,
-):
-    """Saves the generated map in a YAML file in the specified folder."""
-    all_entities = generate_all_entities(tile_map, chunk_size, biome_layers, seed_base)
-    count = sum(len(group.get("entities", [])) for group in all_entities)
-    map_data = {
-        "meta": {
-            "format": 7,
-            "category": "Map",
-            "engineVersion": "249.0.0",
-            "forkId": "",
-            "forkVersion": "",
-            "time": "03/23/2025 18:21:23",
-            "entityCount": count,
-        },
+def write_entity(write, entity):
+    """Writes one entity of an entity group."""
+    if is_transform_only(entity):
+        transform = entity["components"][0]
+        write(
+            TRANSFORM_ENTITY.format(
+                uid=int(entity["uid"]),
+                parent=transform["parent"],
+                pos=transform["pos"],
+            )
+        )
+    else:
+        write_yaml_mapping(write, entity, 4, first_prefix="  - ")
+
+
+def write_transform_entities(write, uids, xs, ys, parent=2):
+    """Writes Transform-only entities from columns of uids and tile positions."""
+    write(
+        "".join(
+            TRANSFORM_ENTITY.format(uid=uid, parent=parent, pos=f"{x},{y}")
+            for uid, x, y in zip(uids.tolist(), xs.tolist(), ys.tolist())
+        )
+    )
+
+
+def group_size(group):
+    """Returns the number of entities of a dict or columnar entity group."""
+    if "entities" in group:
+        return len(group["entities"])
+    return len(group["uids"])
+
+
+def write_group_entities(write, group, start=0, stop=None):
+    """Writes entities start:stop of a dict or columnar (EntityStore) group."""
+    if "entities" in group:
+        for entity in group["entities"][start:stop]:
+            write_entity(write, entity)
+    else:
+        write_transform_entities(
+            write,
+            group["uids"][start:stop],
+            group["xs"][start:stop],
+            group["ys"][start:stop],
+        )
+
+
+def write_group_header(write, group):
+    """Writes the proto line of an entity group and opens its entities."""
+    write(f"- proto: {yaml_scalar(group['proto'])}\n")
+    write("  entities:\n" if group_size(group) else "  entities: []\n")
+
+
+def write_entity_group(write, group):
+    """Writes one item of the map's entities list."""
+    write_group_header(write, group)
+    write_group_entities(write, group)
+
+
+# Entities or chunks rendered per fragment task
+FRAGMENT_SIZE = 8192
+# Chunks of a MapGrid sit under "  - uid:" / "    components:" / "    - type:"
+CHUNK_TABLE_INDENT = 8
+
+# Groups and chunk tables being rendered, set once in each worker process
+fragment_source = None
+
+
+def set_fragment_source(source):
+    """Process pool initializer, holds the data the fragment tasks slice."""
+    global fragment_source
+    fragment_source = source
+
+
+def render_fragment(task):
+    """Renders a slice of an entity group or of a MapGrid chunk table."""
+    kind, index, start, stop = task
+    fragment = []
+    if kind == "chunks":
+        items = fragment_source["chunk_tables"][index][start:stop]
+        write_yaml_mapping(fragment.append, dict(items), CHUNK_TABLE_INDENT)
+    else:
+        group = fragment_source["groups"][index]
+        if start == 0:
+            write_group_header(fragment.append, group)
+        write_group_entities(fragment.append, group, start, stop)
+    return "".join(fragment)
+
+
+def render_entity_groups(all_entities, workers=1):
+    """Yields the YAML text of the map's entities list in order.
+
+    Entity groups and MapGrid chunk tables are split into fragments, rendered
+    by a process pool when workers > 1, and put back together in their
+    original order, so the text does not depend on the worker count.
+    """
+    # The map and grid entities have no proto; only they hold chunk tables
+    grids = [
+        component
+        for group in all_entities
+        if group["proto"] == ""
+        for entity in group["entities"]
+        for component in entity["components"]
+        if component.get("type") == "MapGrid"
+        and isinstance(component.get("chunks"), dict)
+        and component["chunks"]
+    ]
+    source = {
+        "groups": all_entities,
+        "chunk_tables": [list(grid["chunks"].items()) for grid in grids],
+    }
+    tasks = [
+        ("chunks", index, start, start + FRAGMENT_SIZE)
+        for index, items in enumerate(source["chunk_tables"])
+        for start in range(0, len(items), FRAGMENT_SIZE)
+    ]
+    for index, group in enumerate(all_entities):
+        if group["proto"] != "":
+            tasks.extend(
+                ("group", index, start, start + FRAGMENT_SIZE)
+                for start in range(0, max(group_size(group), 1), FRAGMENT_SIZE)
+            )
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers, initializer=set_fragment_source, initargs=(source,)
+        )
+        fragments = pool.imap(render_fragment, tasks)
+    else:
+        set_fragment_source(source)
+        fragments = map(render_fragment, tasks)
+
+    original_chunks = [grid["chunks"] for grid in grids]
+    try:
+        # Chunk fragments come first; swap the rendered tables in while the
+        # grids' groups are written, the workers keep their own copies
+        for grid, items in zip(grids, source["chunk_tables"]):
+            count = len(range(0, len(items), FRAGMENT_SIZE))
+            grid["chunks"] = RenderedBlock(
+                "".join(next(fragments) for _ in range(count))
+            )
+
+        for group in all_entities:
+            if group["proto"] == "":
+                rendered = []
+                write_entity_group(rendered.append, group)
+                yield "".join(rendered)
+                continue
+            for _ in range(0, max(group_size(group), 1), FRAGMENT_SIZE):
+                yield next(fragments)
+    finally:
+        for grid, chunks in zip(grids, original_chunks):
+            grid["chunks"] = chunks
+        set_fragment_source(None)
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def write_map_yaml(all_entities, output_path, seed_base=None, workers=1):
+    """Writes the header and the entity groups as the map's YAML."""
+    count = sum(group_size(group) for group in all_entities)
+    header = map_header(count, seed_base)
+    with profile_stage("write"):
+        with open(output_path, "w", buffering=1024 * 1024) as outfile:
+            write_yaml_mapping(outfile.write, header, 0)
+            outfile.write("entities:\n")
+            for fragment in render_entity_groups(all_entities, workers):
+                outfile.write(fragment)
+
+
+def map_header(entity_count, seed_base=None):
+    """Returns the top level keys written before the entities."""
+    meta = {
+        "format": 7,
+        "category": "Map",
+        "engineVersion": "249.0.0",
+        "forkId": "",
+        "forkVersion": "",
+        "time": "03/23/2025 18:21:23",
+        "entityCount": entity_count,
+    }
+    if seed_base is not None:
+        meta["seed"] = seed_base
+    header = {
+        "meta": meta,
         "maps": [1],
         "grids": [2],
         "orphans": [],
         "nullspace": [],
         "tilemap": TILEMAP,
-        "entities": all_entities,
     }
-    yaml.add_representer(dict, represent_sound_path_specifier)
-    output_path = os.path.join(output_dir, filename)
-    with open(output_path, "w") as outfile:
-        yaml.dump(map_data, outfile, default_flow_style=False, sort_keys=False)
+    return header
 
 
-import numpy as np
-from collections import defaultdict
+# The erosion generate_map applies, lone sand tiles take their surroundings' type
+EROSION_TILE = "FloorSand"
+EROSION_MIN_NEIGHBORS = 1
 
+# Neighbour offsets in the order erosion scans them, which decides majority ties
+NEIGHBOR_OFFSETS = [
+    (dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if not (dy == 0 and dx == 0)
+]
 
-def apply_erosion(tile_map, tile_type, min_neighbors=3):
-    h, w = tile_map.shape
-    new_map = tile_map.copy()
-
-    for y in range(1, h - 1):
-        for x in range(1, w - 1):
-            if tile_map[y, x] == tile_type:
-                neighbors = 0
-                neighbor_types = []
-                for dy in [-1, 0, 1]:
-                    for dx in [-1, 0, 1]:
-                        if dy == 0 and dx == 0:
-                            continue
-                        neighbor_y = y + dy
-                        neighbor_x = x + dx
-                        if 0 <= neighbor_y < h and 0 <= neighbor_x < w:
-                            nt = tile_map[neighbor_y, neighbor_x]
-                            neighbor_types.append(nt)
-                            if nt == tile_type:
-                                neighbors += 1
-                if neighbors < min_neighbors:
-                    counts = defaultdict(int)
-                    for nt in neighbor_types:
-                        counts[nt] += 1
-                    if counts:
-                        max_count = max(counts.values())
-                        candidates = [k for k, v in counts.items() if v == max_count]
-                        majority_type = candidates[0]  # Defines majority_type here
-                        new_map[y, x] = majority_type
-    return new_map
-
-
-def count_isolated_tiles(tile_map, tile_type, min_neighbors=3):
+
+def neighbor_views(tile_map):
+    """Returns, for every inner tile, views of its 8 neighbours in scan order."""
     h, w = tile_map.shape
-    isolated = 0
-    for y in range(1, h - 1):
-        for x in range(1, w - 1):
-            if tile_map[y, x] == tile_type:
-                neighbors = sum(
-                    1
-                    for dy in [-1, 0, 1]
-                    for dx in [-1, 0, 1]
-                    if not (dy == 0 and dx == 0)
-                    and 0 <= y + dy < h
-                    and 0 <= x + dx < w
-                    and tile_map[y + dy, x + dx] == tile_type
-                )
-                if neighbors < min_neighbors:
-                    isolated += 1
-    return isolated
+    return [
+        tile_map[1 + dy : h - 1 + dy, 1 + dx : w - 1 + dx]
+        for dy, dx in NEIGHBOR_OFFSETS
+    ]
+
+
+def isolated_mask(tile_map, tile_type, min_neighbors=3, neighbors=None):
+    """Marks the inner tiles of tile_type with fewer than min_neighbors alike."""
+    if neighbors is None:
+        neighbors = neighbor_views(tile_map)
+    alike = np.zeros(tile_map[1:-1, 1:-1].shape, dtype=np.uint8)
+    for view in neighbors:
+        alike += view == tile_type
+    return (tile_map[1:-1, 1:-1] == tile_type) & (alike < min_neighbors)
+
+
+def erode_into(tile_map, out, tile_type, min_neighbors=3):
+    """Writes one erosion pass of tile_map into out.
+
+    Isolated tiles take the most common type among their 8 neighbours; ties go
+    to the type seen first in NEIGHBOR_OFFSETS order. Returns the number of
+    isolated tiles found in tile_map.
+    """
+    neighbors = neighbor_views(tile_map)
+    isolated = isolated_mask(tile_map, tile_type, min_neighbors, neighbors)
+    out[...] = tile_map
+    isolated_count = int(np.count_nonzero(isolated))
+    if isolated_count == 0:
+        return 0
+
+    neighbor_types = np.stack([view[isolated] for view in neighbors], axis=1)
+    type_counts = np.stack(
+        [
+            np.count_nonzero(neighbor_types == t, axis=1)
+            for t in range(int(neighbor_types.max()) + 1)
+        ],
+        axis=1,
+    )
+    counts = np.take_along_axis(type_counts, neighbor_types, axis=1)
+    first_majority = np.argmax(counts == type_counts.max(axis=1, keepdims=True), axis=1)
+    majority_type = neighbor_types[np.arange(isolated_count), first_majority]
+    out[1:-1, 1:-1][isolated] = majority_type
+    return isolated_count
 
 
 def apply_iterative_erosion(tile_map, tile_type, min_neighbors=3, max_iterations=10):
     """Applies erosion interactively untill there are no more tiles with the declared min neighbors"""
-    iteration = 0
-    while iteration < max_iterations:
-        isolated_before = count_isolated_tiles(tile_map, tile_type, min_neighbors)
-        tile_map = apply_erosion(tile_map, tile_type, min_neighbors)
-        isolated_after = count_isolated_tiles(tile_map, tile_type, min_neighbors)
+    if max_iterations <= 0:
+        return tile_map
+
+    def erode(source, out):
+        return erode_into(source, out, tile_type, min_neighbors)
+
+    front = np.empty_like(tile_map)
+    back = np.empty_like(tile_map)
+    return iterate_erosion(erode, tile_map, front, back, max_iterations)
+
+
+def iterate_erosion(erode, tile_map, front, back, max_iterations):
+    """Runs erosion passes erode(source, out) over ping-pong buffers.
+
+    Returns the buffer holding the final pass, which is front or back.
+    """
+    # Each pass counts the isolated tiles of its input, so the count of the
+    # previous pass' output comes for free with the next pass; when that pass
+    # turns out to be unneeded its buffer is simply not swapped in.
+    isolated_before = erode(tile_map, front)
+    if isolated_before == 0:
+        return front
+    for _ in range(max_iterations - 1):
+        isolated_after = erode(front, back)
         if isolated_after == isolated_before or isolated_after == 0:
             break
-        iteration += 1
-    return tile_map
+        front, back = back, front
+        isolated_before = isolated_after
+    return front
 
 
 # -----------------------------------------------------------------------------
 # Spawn Point Generation
 # -----------------------------------------------------------------------------
-def generate_spawn_points(tile_map, num_points_per_corner=1):
-    """Generates 4 SpawnPointNomads and 4 SpawnPointLatejoin, one on each corner, on FloorPlanetGrass."""
+def corner_distance(corner, xs, ys, w, h):
+    """Distance of tiles from a map corner.
+
+    This is the smallest corner search window (as the square side in tiles
+    from the corner) that contains the tile.
+    """
+    if corner.endswith("right"):
+        xs = w - 1 - xs
+    if corner.startswith("bottom"):
+        ys = h - 1 - ys
+    return np.maximum(xs, ys)
+
+
+def corner_window(corner, side, w, h):
+    """Returns the (y_start, y_end, x_start, x_end) of a corner's search window."""
+    x_start = w - side if corner.endswith("right") else 0
+    y_start = h - side if corner.startswith("bottom") else 0
+    return y_start, y_start + side, x_start, x_start + side
+
+
+def spawn_candidates(tile_map, used, y_start, y_end, x_start, x_end, allowed=None):
+    """Returns the (xs, ys) of spawn candidates inside a window of the map.
+
+    Candidates are free FloorPlanetGrass tiles off the border with at least
+    one free grass neighbour, all of them inside allowed if given. Only the
+    window and a one tile halo around it are read, so tile_map and allowed
+    can be any array-like sliced by rows and columns.
+    """
+    h, w = tile_map.shape
+    top, left = max(y_start - 1, 0), max(x_start - 1, 0)
+    bottom, right = min(y_end + 1, h), min(x_end + 1, w)
+    free_grass = np.asarray(tile_map[top:bottom, left:right]) == (
+        TILEMAP_REVERSE["FloorPlanetGrass"]
+    )
+    if allowed is not None:
+        free_grass &= np.asarray(allowed[top:bottom, left:right])
+    for x, y in used:
+        if top <= y < bottom and left <= x < right:
+            free_grass[y - top, x - left] = False
+    has_free_neighbor = np.zeros_like(free_grass)
+    has_free_neighbor[1:, :] |= free_grass[:-1, :]
+    has_free_neighbor[:-1, :] |= free_grass[1:, :]
+    has_free_neighbor[:, 1:] |= free_grass[:, :-1]
+    has_free_neighbor[:, :-1] |= free_grass[:, 1:]
+    ys, xs = np.nonzero(free_grass & has_free_neighbor)
+    xs += left
+    ys += top
+    inside = (xs >= x_start) & (xs < x_end) & (ys >= y_start) & (ys < y_end)
+    inside &= (xs > 0) & (xs < w - 1) & (ys > 0) & (ys < h - 1)
+    return xs[inside], ys[inside]
+
+
+def generate_spawn_points(
+    tile_map, num_points_per_corner=1, seed_base=None, store=None, allowed=None
+):
+    """Generates 4 SpawnPointNomads and 4 SpawnPointLatejoin, one on each corner, on FloorPlanetGrass.
+
+    The spawn points are added to store, a new EntityStore unless given, which
+    is returned. Both groups are registered even if no corner has room. With
+    allowed, a mask like spawn_area's, they are only placed on its tiles.
+    """
+    if store is None:
+        store = EntityStore()
+    store.proto_id("SpawnPointNomads")
+    store.proto_id("SpawnPointLatejoin")
     h, w = tile_map.shape
-    spawn_positions = set()
-    nomads_entities = []
-    latejoin_entities = []
+    used = set()
+    nomads_positions = []
+    latejoin_positions = []
     corners = ["top_left", "top_right", "bottom_left", "bottom_right"]
     astro_grass_id = TILEMAP_REVERSE["FloorPlanetGrass"]
     directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    initial_size = 15  # Initial size to search for positions
+    max_size = min(w, h) // 2
 
     for corner in corners:
-        found = False
-        initial_size = 15  # Initial size to search for positions
-        while not found and initial_size <= min(w, h) // 2:
-            x_min, x_max, y_min, y_max = get_corner_region(corner, w, h, initial_size)
-            candidates = []
-            # Searchs for AstroTileGrass in the initial size in the corners
-            for y in range(y_min, y_max + 1):
-                for x in range(x_min, x_max + 1):
-                    if (
-                        tile_map[y, x] == astro_grass_id
-                        and (x, y) not in spawn_positions
-                    ):
-                        # Verifies adjacent valid tiles
-                        adjacent = []
-                        for dx, dy in directions:
-                            nx, ny = x + dx, y + dy
-                            if (
-                                0 <= nx < w
-                                and 0 <= ny < h
-                                and tile_map[ny, nx] == astro_grass_id
-                                and (nx, ny) not in spawn_positions
-                            ):
-                                adjacent.append((nx, ny))
-                        if adjacent:
-                            candidates.append((x, y, adjacent))
-            if candidates:
-                x, y, adjacent = random.choice(candidates)
-                adj_x, adj_y = random.choice(adjacent)
-                if random.random() < 0.5:
-                    nomads_pos = (x, y)
-                    latejoin_pos = (adj_x, adj_y)
-                else:
-                    nomads_pos = (adj_x, adj_y)
-                    latejoin_pos = (x, y)
-                nomads_entities.append(
-                    {
-                        "uid": next_uid(),
-                        "components": [
-                            {
-                                "type": "Transform",
-                                "parent": 2,
-                                "pos": f"{nomads_pos[0]},{nomads_pos[1]}",
-                            }
-                        ],
-                    }
-                )
-                latejoin_entities.append(
-                    {
-                        "uid": next_uid(),
-                        "components": [
-                            {
-                                "type": "Transform",
-                                "parent": 2,
-                                "pos": f"{latejoin_pos[0]},{latejoin_pos[1]}",
-                            }
-                        ],
-                    }
-                )
-                spawn_positions.add(nomads_pos)
-                spawn_positions.add(latejoin_pos)
-                found = True
-            else:
-                initial_size += 1
-        if not found:
+        # The search window grows from the corner until it holds a candidate,
+        # so every candidate as close to the corner as the nearest one (or
+        # within the initial window) is eligible. Windows double in size, and
+        # the nearest candidate of a window is the nearest of the whole map.
+        side = initial_size + 1
+        while True:
+            side = min(side, max_size + 1)
+            xs, ys = spawn_candidates(
+                tile_map, used, *corner_window(corner, side, w, h), allowed
+            )
+            if xs.size or side > max_size:
+                break
+            side *= 2
+        distances = corner_distance(corner, xs, ys, w, h)
+        size = max(initial_size, int(distances.min())) if xs.size else max_size + 1
+        if size > max_size:
             print(
                 f"Possible to find an available position at the corner for spawn points {corner}"
             )
+            continue
+
+        # Candidates draw a random rank each and the lowest one wins
+        eligible = distances <= size
+        xs, ys = xs[eligible], ys[eligible]
+        pick = np.argmin(position_bits(seed_base, ("spawn", corner), xs, ys))
+        x, y = int(xs[pick]), int(ys[pick])
+        around = np.asarray(tile_map[max(y - 1, 0) : y + 2, max(x - 1, 0) : x + 2])
+        around = around == astro_grass_id
+        if allowed is not None:
+            around &= np.asarray(allowed[max(y - 1, 0) : y + 2, max(x - 1, 0) : x + 2])
+        adjacent = [
+            (x + dx, y + dy)
+            for dx, dy in directions
+            if 0 <= x + dx < w
+            and 0 <= y + dy < h
+            and around[y + dy - max(y - 1, 0), x + dx - max(x - 1, 0)]
+            and (x + dx, y + dy) not in used
+        ]
+        adj_xs, adj_ys = np.array(adjacent).T
+        pick = np.argmin(
+            position_bits(seed_base, ("spawn", corner, "adjacent"), adj_xs, adj_ys)
+        )
+        adj_x, adj_y = int(adj_xs[pick]), int(adj_ys[pick])
+        if position_random(seed_base, ("spawn", corner, "swap"), x, y) < 0.5:
+            nomads_pos = (x, y)
+            latejoin_pos = (adj_x, adj_y)
+        else:
+            nomads_pos = (adj_x, adj_y)
+            latejoin_pos = (x, y)
+        uid = store.reserve_uids(2)
+        store.add("SpawnPointNomads", [uid], [nomads_pos[0]], [nomads_pos[1]])
+        store.add("SpawnPointLatejoin", [uid + 1], [latejoin_pos[0]], [latejoin_pos[1]])
+        nomads_positions.append(nomads_pos)
+        latejoin_positions.append(latejoin_pos)
+        used.add(nomads_pos)
+        used.add(latejoin_pos)
 
     print("SpawnPointNomads positions:")
-    for ent in nomads_entities:
-        pos = ent["components"][0]["pos"]
-        print(pos)
+    for x, y in nomads_positions:
+        print(f"{x},{y}")
     print("SpawnPointLatejoin positions:")
-    for ent in latejoin_entities:
-        pos = ent["components"][0]["pos"]
-        print(pos)
+    for x, y in latejoin_positions:
+        print(f"{x},{y}")
 
-    # Retorna as entidades no formato correto para o YAML
-    return [
-        {"proto": "SpawnPointNomads", "entities": nomads_entities},
-        {"proto": "SpawnPointLatejoin", "entities": latejoin_entities},
-    ]
+    return store
 
 
-def get_corner_region(corner, w, h, initial_size):
-    """Defines a region to search in the map's corners."""
-    if corner == "top_left":
-        x_min = 1
-        x_max = min(initial_size, w - 2)
-        y_min = 1
-        y_max = min(initial_size, h - 2)
-    elif corner == "top_right":
-        x_min = max(w - 1 - initial_size, 1)
-        x_max = w - 2
-        y_min = 1
-        y_max = min(initial_size, h - 2)
-    elif corner == "bottom_left":
-        x_min = 1
-        x_max = min(initial_size, w - 2)
-        y_min = max(h - 1 - initial_size, 1)
-        y_max = h - 2
-    elif corner == "bottom_right":
-        x_min = max(w - 1 - initial_size, 1)
-        x_max = w - 2
-        y_min = max(h - 1 - initial_size, 1)
-        y_max = h - 2
-    else:
-        raise ValueError("Invalid corner")
-    return x_min, x_max, y_min, y_max
+# -----------------------------------------------------------------------------
+# Connectivity validation
+# -----------------------------------------------------------------------------
+# Spawn points are only placed on the largest component of walkable tiles, so
+# walls can never cut them off from each other. Shallow water (the river
+# FloorWaterEntity) only slows walking down and does not block it.
+BLOCKING_PROTOS = ("WallRock", "WallRockIndestructible")
+SPAWN_PROTOS = ("SpawnPointNomads", "SpawnPointLatejoin")
+
+
+def walkable_mask(tile_map, store, blocking_protos=BLOCKING_PROTOS):
+    """Returns the tiles that are not space and hold no blocking entity."""
+    walkable = tile_map != TILEMAP_REVERSE["Space"]
+    xs, ys = store.positions(blocking_protos)
+    walkable[ys, xs] = False
+    return walkable
+
+
+def merge_components(parent, upper, lower):
+    """Merges the components of each touching (upper, lower) label pair.
+
+    parent maps every label to its root, the smallest label of its component,
+    and is returned updated. Every round hooks the larger root of each pair
+    still apart under the smaller one, then flattens the trees, all on whole
+    arrays.
+    """
+    while True:
+        upper_root, lower_root = parent[upper], parent[lower]
+        apart = upper_root != lower_root
+        if not apart.any():
+            return parent
+        upper, lower = upper[apart], lower[apart]
+        upper_root, lower_root = upper_root[apart], lower_root[apart]
+        np.minimum.at(
+            parent,
+            np.maximum(upper_root, lower_root),
+            np.minimum(upper_root, lower_root),
+        )
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def label_components(walkable):
+    """Labels the 4-connected components of walkable tiles.
+
+    Returns (labels, count), labels being 0 off walkable tiles and 1 to count
+    on them, numbered in the row-major order of their first tile. Each row is
+    split into runs of walkable tiles, and the runs touching the next row's
+    are merged by merge_components.
+    """
+    h, w = walkable.shape
+    starts = walkable.copy()
+    starts[:, 1:] &= ~walkable[:, :-1]
+    runs = np.cumsum(starts, axis=None, dtype=np.int32).reshape(h, w)
+    runs[~walkable] = 0
+    count = int(runs.max(initial=0))
+
+    # Two touching runs overlap from a column where one of them starts
+    touching = walkable[:-1] & walkable[1:] & (starts[:-1] | starts[1:])
+    parent = merge_components(
+        np.arange(count + 1, dtype=np.int32),
+        runs[:-1][touching],
+        runs[1:][touching],
+    )
+
+    # Roots are renumbered from 1, the unwalkable run 0 being its own root
+    roots, labels = np.unique(parent, return_inverse=True)
+    return labels.astype(np.int32)[runs], roots.size - 1
+
+
+def spawn_area(tile_map, store):
+    """Returns the mask of the largest component of walkable tiles.
+
+    Ties go to the component whose first tile comes first in row-major order.
+    """
+    labels, count = label_components(walkable_mask(tile_map, store))
+    if count == 0:
+        return np.zeros(tile_map.shape, dtype=bool)
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    sizes[0] = 0
+    return labels == np.argmax(sizes)
+
+
+def band_walkable(tile_rows, entity_placements, y_start, map_shape):
+    """Returns walkable_mask of a band of full map rows starting at y_start.
+
+    entity_placements are the band's resolve_entity_layers, the border walls
+    being added here.
+    """
+    h, w = map_shape
+    walkable = tile_rows != TILEMAP_REVERSE["Space"]
+    if "WallRockIndestructible" in BLOCKING_PROTOS:
+        walkable &= ~border_mask(h, w, y_start, y_start + tile_rows.shape[0])
+    for entity_protos, xs, ys, choices in entity_placements:
+        protos = np.array(entity_protos, dtype=object)[choices]
+        blocked = np.isin(protos, BLOCKING_PROTOS)
+        walkable[ys[blocked] - y_start, xs[blocked]] = False
+    return walkable
+
+
+class BandedSpawnArea:
+    """spawn_area of a map given a band of rows at a time, for out-of-core maps.
+
+    Bands are labelled by label_components, with their labels numbered on
+    from the previous bands' and kept in a MappedGrid. Components touching
+    across band edges are merged by finish, after which windows of the mask
+    are read like MappedGrid windows.
+    """
+
+    def __init__(self, path, height, width):
+        self.labels = MappedGrid(path, height, width, np.int32)
+        self.count = 0
+        self._sizes = [np.zeros(1, dtype=np.int64)]
+        self._edges = []
+        self._last_row = None
+        self._parent = None
+        self._largest = None
+
+    def add_band(self, y_start, walkable):
+        """Labels the walkable mask of the band of rows starting at y_start."""
+        labels, count = label_components(walkable)
+        self._sizes.append(np.bincount(labels.ravel(), minlength=count + 1)[1:])
+        labels[walkable] += self.count
+        if self._last_row is not None:
+            touching = (self._last_row != 0) & (labels[0] != 0)
+            self._edges.append((self._last_row[touching], labels[0][touching]))
+        self._last_row = labels[-1].copy()
+        self.count += count
+        band = self.labels.rows(y_start, y_start + labels.shape[0])
+        band[...] = labels
+        band.flush()
+
+    def finish(self):
+        """Merges the components of all bands and picks the largest one."""
+        upper = [np.empty(0, dtype=np.int32)] + [edge[0] for edge in self._edges]
+        lower = [np.empty(0, dtype=np.int32)] + [edge[1] for edge in self._edges]
+        self._parent = merge_components(
+            np.arange(self.count + 1, dtype=np.int32),
+            np.concatenate(upper),
+            np.concatenate(lower),
+        )
+        sizes = np.bincount(
+            self._parent,
+            weights=np.concatenate(self._sizes),
+            minlength=self.count + 1,
+        )
+        sizes[0] = 0
+        self._largest = int(np.argmax(sizes)) if self.count else -1
+
+    def __getitem__(self, key):
+        return self._parent[self.labels[key]] == self._largest
+
+
+def spawns_connected(tile_map, store):
+    """Returns whether every spawn point in store can walk to every other one.
+
+    A spawn point on an unwalkable tile counts as disconnected.
+    """
+    xs, ys = store.positions(SPAWN_PROTOS)
+    if xs.size == 0:
+        return True
+    labels, _ = label_components(walkable_mask(tile_map, store))
+    spawn_labels = labels[ys, xs]
+    return bool(spawn_labels[0] != 0 and (spawn_labels == spawn_labels[0]).all())
+
+
+# -----------------------------------------------------------------------------
+# Out-of-core generation
+# -----------------------------------------------------------------------------
+# Very large maps are generated a band of rows at a time. The tile grids live in
+# files mapped one band at a time, noise is sampled per band (it only depends
+# on the coordinate), and entities and decals are spooled to files per layer
+# until the map is written. Memory use then grows with the map width, not its
+# area, and the map written is the same as the in-memory generator's.
+
+# Tiles per band, about 2 MB per noise field
+BAND_TILES = 2**18
+# Spooled records rendered per block when writing
+SPOOL_BLOCK = 65536
+# Decal nodes sit under "    - type: DecalGrid" / "      chunkCollection:"
+DECAL_NODES_INDENT = 8
+# Atmos tiles sit under "    - type: GridAtmosphere" / "      data:"
+ATMOSPHERE_TILES_INDENT = 10
+
+ENTITY_RECORD = np.dtype([("index", "<i8"), ("x", "<i4"), ("y", "<i4")])
+DECAL_RECORD = np.dtype([("x", "<f8"), ("y", "<f8")])
+
+
+def band_rows(width, multiple=1):
+    """Returns how many rows a band holds, a multiple of multiple."""
+    rows = max(1, BAND_TILES // max(width, 1))
+    return max(multiple, rows - rows % multiple)
+
+
+def iter_bands(height, rows):
+    """Yields (y_start, y_end) of consecutive bands of rows."""
+    for y_start in range(0, height, rows):
+        yield y_start, min(y_start + rows, height)
+
+
+class MappedGrid:
+    """A 2-d array kept in a file and mapped a band of rows at a time."""
+
+    def __init__(self, path, height, width, dtype=TILE_DTYPE):
+        self.path = path
+        self.shape = (height, width)
+        self.dtype = np.dtype(dtype)
+        with open(path, "wb") as grid_file:
+            grid_file.truncate(height * width * self.dtype.itemsize)
+
+    def rows(self, y_start, y_end, mode="r+"):
+        """Maps rows y_start:y_end of the grid, writes go to the file."""
+        width = self.shape[1]
+        return np.memmap(
+            self.path,
+            self.dtype,
+            mode,
+            offset=y_start * width * self.dtype.itemsize,
+            shape=(y_end - y_start, width),
+        )
+
+    def __getitem__(self, key):
+        """Reads a [rows, columns] window of slices into memory."""
+        rows, columns = key
+        y_start, y_end, _ = rows.indices(self.shape[0])
+        if y_end <= y_start:
+            return np.empty((0, self.shape[1]), self.dtype)[:, columns]
+        return np.array(self.rows(y_start, y_end, "r")[:, columns])
+
+
+class RecordSpool:
+    """Appends arrays of records to a file and reads them back in blocks."""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.count = 0
+
+    def append(self, records):
+        with open(self.path, "ab") as spool_file:
+            spool_file.write(records.tobytes())
+        self.count += records.size
+
+    def blocks(self, size=SPOOL_BLOCK):
+        with open(self.path, "rb") as spool_file:
+            while True:
+                block = np.fromfile(spool_file, self.dtype, size)
+                if not block.size:
+                    return
+                yield block
+
+
+def erode_grid_into(grid, out, tile_type, min_neighbors=3):
+    """Writes one erosion pass of a MappedGrid into out, band by band.
+
+    Each band is eroded with a one row halo of its neighbours, so the pass
+    and its isolated tile count are the same as erode_into's.
+    """
+    h, w = grid.shape
+    isolated = 0
+    for y_start, y_end in iter_bands(h, band_rows(w)):
+        top, bottom = max(y_start - 1, 0), min(y_end + 1, h)
+        slab = np.array(grid.rows(top, bottom, "r"))
+        eroded = np.empty_like(slab)
+        isolated += erode_into(slab, eroded, tile_type, min_neighbors)
+        band = out.rows(y_start, y_end)
+        band[...] = eroded[y_start - top : y_end - top]
+        band.flush()
+    return isolated
+
+
+def generate_map_out_of_core(
+    width,
+    height,
+    seed_base,
+    config,
+    output_path,
+    work_dir=None,
+    chunk_size=16,
+    check_connectivity=False,
+):
+    """Generates a map like generate_map, holding only a band of rows in memory.
+
+    Temporary grids and spools go to a directory created in work_dir, or in
+    the system's temporary directory.
+    """
+    tile_layers = ordered_layers(config, "BiomeTileLayer")
+    with tempfile.TemporaryDirectory(prefix="mapgen-", dir=work_dir) as temp_dir:
+        tiles = MappedGrid(os.path.join(temp_dir, "tiles"), height, width)
+        with profile_stage("tile_map"):
+            counts = [0] * len(tile_layers)
+            for y_start, y_end in iter_bands(height, band_rows(width)):
+                rows = tiles.rows(y_start, y_end)
+                rows[...] = TILEMAP_REVERSE["FloorDirt"]
+                band_counts = place_tile_layers(
+                    rows,
+                    tile_layers,
+                    seed_base,
+                    window_noise_source(0, y_start, width, y_end - y_start),
+                    (0, y_start),
+                )
+                counts = [total + count for total, count in zip(counts, band_counts)]
+                rows.flush()
+                del rows
+            for layer, count in zip(tile_layers, counts):
+                print(f"Layer {layer['tile_type']}: {count} tiles placed")
+
+        # Applies erosion to lone sand tiles, overwritting it with surrounding tiles
+        def erode(source, out):
+            return erode_grid_into(
+                source, out, TILEMAP_REVERSE[EROSION_TILE], EROSION_MIN_NEIGHBORS
+            )
+
+        with profile_stage("erosion"):
+            front = MappedGrid(os.path.join(temp_dir, "front"), height, width)
+            back = MappedGrid(os.path.join(temp_dir, "back"), height, width)
+            eroded = iterate_erosion(erode, tiles, front, back, max_iterations=10)
+
+        with profile_stage("border"):
+            bordered = MappedGrid(
+                os.path.join(temp_dir, "bordered"), height + 2, width + 2
+            )
+            for y_start, y_end in iter_bands(height + 2, band_rows(width + 2)):
+                rows = bordered.rows(y_start, y_end)
+                rows[...] = TILEMAP_REVERSE["FloorDirt"]
+                inner_start, inner_end = max(y_start, 1), min(y_end, height + 1)
+                if inner_start < inner_end:
+                    rows[inner_start - y_start : inner_end - y_start, 1:-1] = (
+                        eroded.rows(inner_start - 1, inner_end - 1, "r")
+                    )
+                rows.flush()
+                del rows
+
+        write_map_out_of_core(
+            bordered,
+            config,
+            output_path,
+            seed_base,
+            temp_dir,
+            chunk_size,
+            check_connectivity,
+        )
+
+
+def write_map_out_of_core(
+    tile_map,
+    config,
+    output_path,
+    seed_base,
+    temp_dir,
+    chunk_size,
+    check_connectivity=False,
+):
+    """Places entities and decals on a bordered MappedGrid and writes the map.
+
+    Entities are spooled per (layer, proto) and decals per (layer, decal_id)
+    so they can be written grouped the way generate_all_entities groups them.
+    With check_connectivity the walkable tiles are labelled band by band
+    with BandedSpawnArea, and spawn points only placed on the largest area.
+    """
+    store = EntityStore()
+    h, w = tile_map.shape
+    entity_layers = ordered_layers(config, "BiomeEntityLayer")
+    decal_layers = ordered_layers(config, "BiomeDecalLayer")
+
+    entity_counts = [0] * len(entity_layers)
+    entity_spools = [{} for _ in entity_layers]  # Keyed by proto, first seen first
+    decal_colors = [None] * len(decal_layers)
+    decal_spools = [{} for _ in decal_layers]  # Keyed by decal_id, first seen first
+    spawn_area_bands = None
+    if check_connectivity:
+        spawn_area_bands = BandedSpawnArea(os.path.join(temp_dir, "labels"), h, w)
+    for y_start, y_end in iter_bands(h, band_rows(w, chunk_size)):
+        tile_rows = np.array(tile_map.rows(y_start, y_end, "r"))
+        layer_field = window_noise_source(0, y_start, w, y_end - y_start)
+
+        with profile_stage("entities"):
+            entity_placements = resolve_entity_layers(
+                tile_rows, entity_layers, seed_base, layer_field, (0, y_start), (h, w)
+            )
+            for index, (entity_protos, xs, ys, choices) in enumerate(entity_placements):
+                records = np.empty(xs.size, ENTITY_RECORD)
+                records["index"] = entity_counts[index] + np.arange(xs.size)
+                records["x"], records["y"] = xs, ys
+                entity_counts[index] += xs.size
+                for choice, picked in iter_choice_groups(choices):
+                    proto = entity_protos[choice]
+                    spools = entity_spools[index]
+                    if proto not in spools:
+                        path = os.path.join(temp_dir, f"entities-{index}-{len(spools)}")
+                        spools[proto] = RecordSpool(path, ENTITY_RECORD)
+                    spools[proto].append(records[picked])
+
+        if spawn_area_bands is not None:
+            with profile_stage("connectivity"):
+                spawn_area_bands.add_band(
+                    y_start,
+                    band_walkable(tile_rows, entity_placements, y_start, (h, w)),
+                )
+
+        with profile_stage("decals"):
+            decal_placements = resolve_decal_layers(
+                tile_rows, decal_layers, seed_base, layer_field, (0, y_start), (h, w)
+            )
+            for index, (decal_ids, color, choices, pos_x, pos_y) in enumerate(
+                decal_placements
+            ):
+                decal_colors[index] = color
+                records = np.empty(choices.size, DECAL_RECORD)
+                records["x"], records["y"] = pos_x, pos_y
+                for choice, picked in iter_choice_groups(choices):
+                    decal_id = decal_ids[choice]
+                    spools = decal_spools[index]
+                    if decal_id not in spools:
+                        path = os.path.join(temp_dir, f"decals-{index}-{len(spools)}")
+                        spools[decal_id] = RecordSpool(path, DECAL_RECORD)
+                    spools[decal_id].append(records[picked])
+
+    # Groups keep the order of the in-memory generator: protos by first
+    # appearance, each with its layers' entities in priority order
+    proto_spools = {}
+    for index, spools in enumerate(entity_spools):
+        uid_base = store.reserve_uids(entity_counts[index])
+        for proto, spool in spools.items():
+            proto_spools.setdefault(proto, []).append((uid_base, spool))
+    entity_count = {
+        proto: sum(spool.count for _, spool in spools)
+        for proto, spools in proto_spools.items()
+    }
+    wall_count = h * w - max(h - 2, 0) * max(w - 2, 0)
+    wall_uid_base = store.reserve_uids(wall_count)
+    entity_count["WallRockIndestructible"] = wall_count
+    for proto, count in entity_count.items():
+        print(f"Generated {count} amount of {proto}")
+
+    decal_nodes = {}
+    for index, spools in enumerate(decal_spools):
+        for decal_id, spool in spools.items():
+            node = decal_nodes.setdefault(
+                decal_id, {"color": decal_colors[index], "spools": []}
+            )
+            node["spools"].append(spool)
+    total_decals = sum(
+        spool.count for node in decal_nodes.values() for spool in node["spools"]
+    )
+    print(f"Total decal nodes generated: {len(decal_nodes)}")
+    print(f"Total decals: {total_decals}")
+
+    # Spawn points are few, they go in the store and are written from there
+    if spawn_area_bands is not None:
+        with profile_stage("connectivity"):
+            spawn_area_bands.finish()
+    with profile_stage("spawn_points"):
+        generate_spawn_points(
+            tile_map, seed_base=seed_base, store=store, allowed=spawn_area_bands
+        )
+
+    def write_chunks(write):
+        for y_start, y_end in iter_bands(h, band_rows(w, chunk_size)):
+            encoded = encode_chunks(tile_map.rows(y_start, y_end, "r"), chunk_size)
+            for (cx, cy), tiles in encoded.items():
+                cy += y_start // chunk_size
+                chunk = {"ind": f"{cx},{cy}", "tiles": tiles, "version": 6}
+                write_yaml_mapping(write, {f"{cx},{cy}": chunk}, CHUNK_TABLE_INDENT)
+
+    def write_decal_nodes(write):
+        dash = " " * DECAL_NODES_INDENT + "- "
+        global_index = 0
+        for decal_id, node in decal_nodes.items():
+            header = {"node": {"color": node["color"], "id": decal_id}}
+            write_yaml_mapping(write, header, DECAL_NODES_INDENT + 2, dash)
+            write(" " * (DECAL_NODES_INDENT + 2) + "decals:\n")
+            for spool in node["spools"]:
+                for block in spool.blocks():
+                    positions = {
+                        str(global_index + offset): f"{x:.7f},{y:.7f}"
+                        for offset, (x, y) in enumerate(
+                            zip(block["x"].tolist(), block["y"].tolist())
+                        )
+                    }
+                    write_yaml_mapping(write, positions, DECAL_NODES_INDENT + 4)
+                    global_index += block.size
+
+    def write_atmosphere_tiles(write):
+        for row in atmosphere_tile_rows(w, h, 4):
+            write_yaml_mapping(write, row, ATMOSPHERE_TILES_INDENT)
+
+    main_group = main_entity_group(
+        StreamedBlock(write_chunks),
+        StreamedBlock(write_decal_nodes) if decal_nodes else [],
+        StreamedBlock(write_atmosphere_tiles),
+        4,
+    )
+    count = len(main_group["entities"]) + sum(entity_counts) + wall_count + len(store)
+    with profile_stage("write"):
+        with open(output_path, "w", buffering=1024 * 1024) as outfile:
+            write = outfile.write
+            write_yaml_mapping(write, map_header(count, seed_base), 0)
+            write("entities:\n")
+            write_entity_group(write, main_group)
+            for proto, spools in proto_spools.items():
+                write_group_header(write, {"proto": proto, "entities": spools})
+                for uid_base, spool in spools:
+                    for block in spool.blocks():
+                        write_transform_entities(
+                            write, uid_base + block["index"], block["x"], block["y"]
+                        )
+            write_group_header(
+                write,
+                {"proto": "WallRockIndestructible", "entities": range(wall_count)},
+            )
+            uid = wall_uid_base
+            for y_start, y_end in iter_bands(h, band_rows(w)):
+                ys, xs = np.nonzero(border_mask(h, w, y_start, y_end))
+                write_transform_entities(
+                    write, uid + np.arange(xs.size), xs, ys + y_start
+                )
+                uid += xs.size
+            for group in store.groups():
+                write_entity_group(write, group)
+
+
+# -----------------------------------------------------------------------------
+# Lazy chunk generation
+# -----------------------------------------------------------------------------
+class LazyMap:
+    """Generates any window or chunk of a map on demand.
+
+    Tiles, entities and decals only depend on the tiles around them, so a
+    window is generated from its own noise and a one tile halo for erosion,
+    and matches the same window of the full map. Coordinates are those of the
+    bordered map, like the positions and chunk keys of the saved map.
+    UIDs and decal indices number the whole map, so chunks leave them out.
+    Spawn points need the whole map too, so chunks leave them out as well
+    and spawn_points places them.
+    """
+
+    def __init__(self, width, height, seed, config=None, chunk_size=16):
+        if EROSION_MIN_NEIGHBORS > 1:
+            # Only with one neighbour does a pass never isolate more tiles,
+            # deeper erosion depends on how many passes the whole map needs
+            raise ValueError("Lazy maps only support single pass erosion")
+        if config is None:
+            config = MAP_CONFIG
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.shape = (height + 2, width + 2)
+        self.tile_layers = ordered_layers(config, "BiomeTileLayer")
+        self.entity_layers = ordered_layers(config, "BiomeEntityLayer")
+        self.decal_layers = ordered_layers(config, "BiomeDecalLayer")
+        self._spawn_points = None
+
+    def __getitem__(self, key):
+        """Returns the tiles of a [rows, columns] window of slices."""
+        rows, columns = key
+        y_start, y_end, _ = rows.indices(self.shape[0])
+        x_start, x_end, _ = columns.indices(self.shape[1])
+        y_end, x_end = max(y_start, y_end), max(x_start, x_end)
+        tiles = np.full(
+            (y_end - y_start, x_end - x_start),
+            TILEMAP_REVERSE["FloorDirt"],
+            dtype=TILE_DTYPE,
+        )
+        # The window without the border, in the coordinates of generate_tile_map
+        top, bottom = max(y_start, 1) - 1, min(y_end, self.height + 1) - 1
+        left, right = max(x_start, 1) - 1, min(x_end, self.width + 1) - 1
+        if top < bottom and left < right:
+            tiles[
+                top + 1 - y_start : bottom + 1 - y_start,
+                left + 1 - x_start : right + 1 - x_start,
+            ] = self.eroded_tiles(top, bottom, left, right)
+        return tiles
+
+    def eroded_tiles(self, top, bottom, left, right):
+        """Returns a window of the eroded map, before the border is added."""
+        halo_top, halo_bottom = max(top - 1, 0), min(bottom + 1, self.height)
+        halo_left, halo_right = max(left - 1, 0), min(right + 1, self.width)
+        tiles = np.full(
+            (halo_bottom - halo_top, halo_right - halo_left),
+            TILEMAP_REVERSE["FloorDirt"],
+            dtype=TILE_DTYPE,
+        )
+        layer_field = window_noise_source(halo_left, halo_top, *tiles.shape[::-1])
+        place_tile_layers(
+            tiles, self.tile_layers, self.seed, layer_field, (halo_left, halo_top)
+        )
+        # The halo is only read as neighbours, its own erosion is cropped off
+        eroded = np.empty_like(tiles)
+        erode_into(tiles, eroded, TILEMAP_REVERSE[EROSION_TILE], EROSION_MIN_NEIGHBORS)
+        return eroded[
+            top - halo_top : bottom - halo_top, left - halo_left : right - halo_left
+        ]
+
+    def spawn_points(self):
+        """Returns the spawn points' EntityStore, placed as generate_map does.
+
+        They are only placed on the largest walkable area, so the first call
+        labels the whole map band by band with BandedSpawnArea, like
+        generate_map_out_of_core, before searching from the corners.
+        """
+        if self._spawn_points is None:
+            h, w = self.shape
+            with tempfile.TemporaryDirectory(prefix="mapgen-") as temp_dir:
+                area = BandedSpawnArea(os.path.join(temp_dir, "labels"), h, w)
+                for y_start, y_end in iter_bands(h, band_rows(w)):
+                    tiles = self[y_start:y_end, :]
+                    entity_placements = resolve_entity_layers(
+                        tiles,
+                        self.entity_layers,
+                        self.seed,
+                        window_noise_source(0, y_start, w, y_end - y_start),
+                        (0, y_start),
+                        self.shape,
+                    )
+                    area.add_band(
+                        y_start,
+                        band_walkable(tiles, entity_placements, y_start, self.shape),
+                    )
+                area.finish()
+                self._spawn_points = generate_spawn_points(
+                    self, seed_base=self.seed, allowed=area
+                )
+        return self._spawn_points
+
+    def chunk(self, cx, cy):
+        """Returns the tiles, entities and decals of chunk (cx, cy).
+
+        Tiles are a chunk_size square padded with Space past the map edge, as
+        encode_tiles expects. Entities are {"proto", "pos"} and decals
+        {"id", "color", "position"} dicts, in the order they are saved.
+        Spawn points are not included, see spawn_points.
+        """
+        size = self.chunk_size
+        h, w = self.shape
+        x_start, y_start = cx * size, cy * size
+        if not (0 <= x_start < w and 0 <= y_start < h):
+            raise IndexError(f"Chunk {cx},{cy} is outside the {w}x{h} map")
+        tiles = self[y_start : y_start + size, x_start : x_start + size]
+        y_end, x_end = y_start + tiles.shape[0], x_start + tiles.shape[1]
+        origin = (x_start, y_start)
+        layer_field = window_noise_source(x_start, y_start, *tiles.shape[::-1])
+
+        entities = []
+        for entity_protos, xs, ys, choices in resolve_entity_layers(
+            tiles, self.entity_layers, self.seed, layer_field, origin, self.shape
+        ):
+            entities.extend(
+                {"proto": entity_protos[choice], "pos": f"{x},{y}"}
+                for choice, x, y in zip(choices.tolist(), xs.tolist(), ys.tolist())
+            )
+        ys, xs = np.nonzero(border_mask(h, w, y_start, y_end, x_start, x_end))
+        entities.extend(
+            {"proto": "WallRockIndestructible", "pos": f"{x},{y}"}
+            for x, y in zip((xs + x_start).tolist(), (ys + y_start).tolist())
+        )
+
+        decals = []
+        for decal_ids, color, choices, pos_x, pos_y in resolve_decal_layers(
+            tiles, self.decal_layers, self.seed, layer_field, origin, self.shape
+        ):
+            decals.extend(
+                {
+                    "id": decal_ids[choice],
+                    "color": color,
+                    "position": f"{x:.7f},{y:.7f}",
+                }
+                for choice, x, y in zip(
+                    choices.tolist(), pos_x.tolist(), pos_y.tolist()
+                )
+            )
+
+        padded = np.zeros((size, size), dtype=TILE_DTYPE)
+        padded[: tiles.shape[0], : tiles.shape[1]] = tiles
+        return {
+            "ind": f"{cx},{cy}",
+            "tiles": padded,
+            "entities": entities,
+            "decals": decals,
+        }
+
+
+def generate_chunk(width, height, seed, cx, cy, config=None, chunk_size=16):
+    """Generates only chunk (cx, cy) of a map, see LazyMap.chunk."""
+    return LazyMap(width, height, seed, config, chunk_size).chunk(cx, cy)
+
+
+# -----------------------------------------------------------------------------
+# Generated map cache
+# -----------------------------------------------------------------------------
+# Bump whenever a change makes the same seed, size and config generate a
+# different map, so cached maps from older versions are not served.
+GENERATOR_VERSION = 2
+
+
+def config_value_key(value):
+    """Returns a repr-stable form of a MAP_CONFIG value for fingerprinting.
+
+    Enums are reduced to their names and tile_condition functions to the
+    result they give for every tile id, which is all the generator sees.
+    """
+    if isinstance(value, dict):
+        return tuple(
+            sorted((key, config_value_key(item)) for key, item in value.items())
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(config_value_key(item) for item in value)
+    if callable(value):
+        return tuple(bool(value(tile_id)) for tile_id in range(max(TILEMAP) + 1))
+    return getattr(value, "name", value)
+
+
+# The seed line of a saved map's meta, see map_header
+META_SEED_LINE = re.compile(r"^  seed: (-?\d+)$")
+
+
+def map_cache_key(seed_base, width, height, config, check_connectivity):
+    """Returns the file name a generated map is cached under."""
+    key = (
+        GENERATOR_VERSION,
+        seed_base,
+        width,
+        height,
+        config_value_key(config),
+        bool(check_connectivity),
+    )
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".yml"
+
+
+def saved_map_seed(path):
+    """Returns the seed in the meta of the map saved at path, or None."""
+    with open(path) as map_file:
+        for line in map_file:
+            match = META_SEED_LINE.match(line.rstrip("\n"))
+            if match:
+                return int(match.group(1))
+            if line.startswith("entities:"):
+                return None
+    return None
+
+
+def load_cached_map(cache_dir, cache_key, output_path):
+    """Copies a cached map to output_path, returns its seed or None if not cached.
+
+    The seed is the one in the map's meta, the seed it was generated with.
+    """
+    cached_path = os.path.join(cache_dir, cache_key)
+    try:
+        shutil.copyfile(cached_path, output_path)
+    except FileNotFoundError:
+        return None
+    os.utime(cached_path)  # Keeps recently served maps when trimming
+    return saved_map_seed(output_path)
+
+
+def store_cached_map(cache_dir, cache_key, output_path, max_bytes):
+    """Adds a generated map to the cache, evicting the oldest above max_bytes."""
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, cache_key)
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    shutil.copyfile(output_path, temp_path)
+    os.replace(temp_path, cached_path)
+    trim_cache_dir(cache_dir, max_bytes, ".yml")
+
+
+# -----------------------------------------------------------------------------
+# Pre-generated map pool
+# -----------------------------------------------------------------------------
+# Maps are generated ahead of time during a round into a pool directory, named
+# "<width>x<height>_<fingerprint>_<seed>.yml", and one is renamed into place on
+# restart. The fingerprint changes with the generator and its config, so a map
+# pre-generated before a git pull is never promoted by the code after it.
+def pool_fingerprint(config, check_connectivity):
+    """Returns the fingerprint of the code and config that generate pool maps.
+
+    It holds what map_cache_key holds but the seed and size.
+    """
+    key = (GENERATOR_VERSION, config_value_key(config), bool(check_connectivity))
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+
+
+def remove_stale_pool_maps(pool_dir, fingerprint):
+    """Deletes the pool maps generated with another fingerprint."""
+    if not os.path.isdir(pool_dir):
+        return
+    for entry in os.scandir(pool_dir):
+        if entry.name.endswith(".yml") and f"_{fingerprint}_" not in entry.name:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue  # Removed by another process in the meantime
+            print(f"Removed stale pool map {entry.name}")
+
+
+def pool_maps(pool_dir, width, height, fingerprint):
+    """Returns the paths of the finished pool maps of a size, oldest first."""
+    if not os.path.isdir(pool_dir):
+        return []
+    prefix = f"{width}x{height}_{fingerprint}_"
+    maps = []
+    for entry in os.scandir(pool_dir):
+        if entry.name.startswith(prefix) and entry.name.endswith(".yml"):
+            try:
+                maps.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue  # Promoted by another process in the meantime
+    return [path for _, path in sorted(maps)]
+
+
+def next_pool_map(pool_dir, pool_size, width, height, fingerprint):
+    """Returns (filename, seed) of the next map to pre-generate, or None if full."""
+    remove_stale_pool_maps(pool_dir, fingerprint)
+    maps = pool_maps(pool_dir, width, height, fingerprint)
+    if len(maps) >= pool_size:
+        return None
+    while True:
+        seed_base = random.randint(0, 1000000)
+        filename = f"{width}x{height}_{fingerprint}_{seed_base}.yml"
+        if os.path.join(pool_dir, filename) not in maps:
+            return filename, seed_base
+
+
+def promote_pool_map(pool_dir, width, height, output_path, fingerprint):
+    """Moves the oldest pool map to output_path, returns its name or None.
+
+    os.replace is atomic, so a map is either fully in place or not at all,
+    and two servers promoting at once never get the same map. Maps of
+    another fingerprint are deleted instead of promoted.
+    """
+    remove_stale_pool_maps(pool_dir, fingerprint)
+    for path in pool_maps(pool_dir, width, height, fingerprint):
+        try:
+            os.replace(path, output_path)
+        except FileNotFoundError:
+            continue  # Promoted by another process in the meantime
+        return os.path.basename(path)
+    return None
+
+
+def lower_priority():
+    """Runs the rest of this process at the lowest CPU priority, where supported."""
+    if hasattr(os, "nice"):
+        os.nice(19)
 
 
 # -----------------------------------------------------------------------------
@@ -1147,44 +3063,525 @@ MAP_CONFIG = [
     },
 ]
 
+
 # -----------------------------------------------------------------------------
 # Execution
 # -----------------------------------------------------------------------------
-start_time = time.time()
+# -----------------------------------------------------------------------------
+# Map generation API
+# -----------------------------------------------------------------------------
+def default_output_path():
+    """Returns the path the server loads the map from."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, "Resources", "Maps", "civ", "nomads_classic.yml")
+
+
+def generate_map_parts(
+    width,
+    height,
+    seed_base,
+    config=None,
+    noise_cache=None,
+    chunk_size=16,
+    check_connectivity=True,
+):
+    """Runs the stages of an in core map, everything generate_map does but
+    writing it, for the scripts that look at maps instead of saving them.
+
+    Returns the dict of generate_all_entities with the bordered tile map
+    added as "tile_map". config defaults to MAP_CONFIG and noise_cache to a
+    new NoiseFieldCache over the bordered map.
+    """
+    if config is None:
+        config = MAP_CONFIG
+    if noise_cache is None:
+        # Noise fields are shared between stages over the bordered map area
+        noise_cache = NoiseFieldCache(width + 2, height + 2)
+
+    with profile_stage("tile_map"):
+        tile_map = generate_tile_map(
+            width,
+            height,
+            layers_of_type(config, "BiomeTileLayer"),
+            seed_base,
+            noise_cache,
+        )
+
+    # Applies erosion to lone sand tiles, overwritting it with surrounding tiles
+    with profile_stage("erosion"):
+        tile_map = apply_iterative_erosion(
+            tile_map, TILEMAP_REVERSE[EROSION_TILE], EROSION_MIN_NEIGHBORS
+        )
+
+    with profile_stage("border"):
+        bordered_tile_map = add_border(
+            tile_map, border_value=TILEMAP_REVERSE["FloorDirt"]
+        )
+
+    parts = generate_all_entities(
+        bordered_tile_map,
+        chunk_size,
+        config,
+        seed_base,
+        noise_cache,
+        check_connectivity,
+    )
+    parts["tile_map"] = bordered_tile_map
+    return parts
+
+
+def generate_map(
+    width,
+    height,
+    seed=None,
+    config=None,
+    output=None,
+    workers=1,
+    noise_cache=None,
+    noise_cache_dir=None,
+    noise_cache_bytes=1024**3,
+    map_cache_dir=None,
+    map_cache_bytes=1024**3,
+    out_of_core=False,
+    work_dir=None,
+    profile=False,
+    cprofile=False,
+    check_connectivity=True,
+):
+    """Generates a map of width x height tiles into output, returns its seed.
+
+    config defaults to MAP_CONFIG and output to the map the server loads. The
+    map is written under a temporary name and renamed into place, so the
+    server never loads a partly written file. A noise_cache built for the
+    bordered size can be passed in to keep noise fields and sampling workers
+    across calls, otherwise one is created for this map.
+
+    With check_connectivity the spawn points are only placed on the largest
+    area of walkable tiles, so walls never cut them off from each other.
+
+    With out_of_core the map is generated by generate_map_out_of_core, in
+    bands with its grids in work_dir, and workers and the noise cache are
+    not used.
+
+    With profile a report of each stage and layer is written next to output,
+    and with cprofile too a cProfile dump, see profile_run.
+    """
+    if seed is None:
+        seed = random.randint(0, 1000000)
+    if config is None:
+        config = MAP_CONFIG
+    if output is None:
+        output = default_output_path()
+    chunk_size = 16
+
+    if profile:
+        details = {
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "workers": workers,
+            "out_of_core": out_of_core,
+        }
+        with profile_run(output, config, details, cprofile):
+            return generate_map(
+                width,
+                height,
+                seed,
+                config,
+                output,
+                workers,
+                noise_cache,
+                noise_cache_dir,
+                noise_cache_bytes,
+                map_cache_dir,
+                map_cache_bytes,
+                out_of_core,
+                work_dir,
+                check_connectivity=check_connectivity,
+            )
+
+    output_dir = os.path.dirname(os.path.abspath(output))
+    os.makedirs(output_dir, exist_ok=True)
+    temp_filename = f"{os.path.basename(output)}.{os.getpid()}.tmp"
+    temp_path = os.path.join(output_dir, temp_filename)
+
+    if map_cache_dir:
+        cache_key = map_cache_key(seed, width, height, config, check_connectivity)
+        cached_seed = load_cached_map(map_cache_dir, cache_key, temp_path)
+        if cached_seed is not None:
+            os.replace(temp_path, output)
+            print("Map copied from cache")
+            return cached_seed
+
+    if out_of_core:
+        generate_map_out_of_core(
+            width,
+            height,
+            seed,
+            config,
+            temp_path,
+            work_dir,
+            chunk_size,
+            check_connectivity,
+        )
+        if map_cache_dir:
+            store_cached_map(map_cache_dir, cache_key, temp_path, map_cache_bytes)
+        os.replace(temp_path, output)
+        return seed
+
+    sampler = None
+    if noise_cache is None:
+        if workers > 1:
+            print(f"Sampling noise with {workers} workers")
+            sampler = StripeNoiseSampler(width + 2, height + 2, workers, chunk_size)
+        # Noise fields are shared between stages over the bordered map area
+        noise_cache = NoiseFieldCache(
+            width + 2,
+            height + 2,
+            cache_dir=noise_cache_dir,
+            cache_dir_bytes=noise_cache_bytes,
+            sampler=sampler,
+        )
+
+    try:
+        parts = generate_map_parts(
+            width, height, seed, config, noise_cache, chunk_size, check_connectivity
+        )
+        write_map_yaml(parts["entities"], temp_path, seed, workers)
+    finally:
+        if sampler is not None:
+            sampler.close()
+    print(
+        f"Noise fields: {noise_cache.misses - noise_cache.disk_hits} sampled, "
+        f"{noise_cache.disk_hits} loaded from disk, {noise_cache.hits} reused"
+    )
+    if map_cache_dir:
+        store_cached_map(map_cache_dir, cache_key, temp_path, map_cache_bytes)
+    os.replace(temp_path, output)
+    return seed
+
+
+# -----------------------------------------------------------------------------
+# Generation daemon
+# -----------------------------------------------------------------------------
+# Requests and replies are one JSON object per line on a Unix socket. A request
+# holds the generate_map arguments width, height and optionally seed, output,
+# out_of_core, profile, cprofile and check_connectivity; the reply holds the
+# seed of the map and seconds taken, or an error message.
+# Maps are always generated from this module's MAP_CONFIG.
+class MapDaemon:
+    """Generates maps on request in one long-lived process.
+
+    Imports, rendered YAML scalars and the noise sampling workers of the last
+    map size stay warm between requests. Noise fields are keyed by their
+    seed, so the kept noise cache only saves sampling when a request repeats
+    a seed.
+    """
+
+    def __init__(
+        self,
+        socket_path,
+        workers=1,
+        noise_cache_dir=None,
+        noise_cache_bytes=1024**3,
+        map_cache_dir=None,
+        map_cache_bytes=1024**3,
+    ):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.noise_cache_dir = noise_cache_dir
+        self.noise_cache_bytes = noise_cache_bytes
+        self.map_cache_dir = map_cache_dir
+        self.map_cache_bytes = map_cache_bytes
+        self.size = None
+        self.sampler = None
+        self.noise_cache = None
+
+    def warm_noise_cache(self, width, height):
+        """Returns the noise cache for a map size, replacing the previous size's."""
+        if self.size != (width, height):
+            self.close()
+            if self.workers > 1:
+                self.sampler = StripeNoiseSampler(width + 2, height + 2, self.workers)
+            self.noise_cache = NoiseFieldCache(
+                width + 2,
+                height + 2,
+                cache_dir=self.noise_cache_dir,
+                cache_dir_bytes=self.noise_cache_bytes,
+                sampler=self.sampler,
+            )
+            self.size = (width, height)
+        return self.noise_cache
+
+    def handle(self, request):
+        """Generates the map of one request and returns the reply."""
+        start_time = time.time()
+        width, height = int(request["width"]), int(request["height"])
+        seed = generate_map(
+            width,
+            height,
+            seed=request.get("seed"),
+            output=request.get("output"),
+            workers=self.workers,
+            noise_cache=self.warm_noise_cache(width, height),
+            map_cache_dir=self.map_cache_dir,
+            map_cache_bytes=self.map_cache_bytes,
+            out_of_core=bool(request.get("out_of_core", False)),
+            profile=bool(request.get("profile", False)),
+            cprofile=bool(request.get("cprofile", False)),
+            check_connectivity=bool(request.get("check_connectivity", True)),
+        )
+        return {"seed": seed, "seconds": round(time.time() - start_time, 3)}
+
+    def serve_forever(self):
+        """Answers requests one at a time until interrupted."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # Left over from a daemon that died
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.socket_path)
+            server.listen()
+            print(f"Waiting for map requests on {self.socket_path}")
+            while True:
+                connection, _ = server.accept()
+                try:
+                    with connection, connection.makefile("rwb") as stream:
+                        try:
+                            reply = self.handle(json.loads(stream.readline()))
+                        except Exception as error:
+                            reply = {"error": f"{type(error).__name__}: {error}"}
+                        stream.write(json.dumps(reply).encode("utf-8") + b"\n")
+                        stream.flush()
+                except OSError as error:
+                    # The client hung up before its reply, keep serving the rest
+                    print(f"Could not send the reply: {error}")
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            self.close()
+
+    def close(self):
+        if self.sampler is not None:
+            self.sampler.close()
+        self.size = self.sampler = self.noise_cache = None
+
+
+def request_map(socket_path, **request):
+    """Asks the daemon on socket_path for a map and returns its reply.
+
+    Raises OSError if no daemon is listening, and RuntimeError if the daemon
+    could not generate the map.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+            reply = json.loads(stream.readline())
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the nomads_classic map.")
+    parser.add_argument("width", type=int, nargs="?", help="map width in tiles")
+    parser.add_argument("height", type=int, nargs="?", help="map height in tiles")
+    parser.add_argument("--seed", type=int, help="map seed, random if not given")
+    parser.add_argument(
+        "--noise-cache",
+        metavar="DIR",
+        help="keep noise fields in DIR so reruns with the same seed and size reuse them",
+    )
+    parser.add_argument(
+        "--noise-cache-size",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="maximum size of the noise cache directory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--map-cache",
+        metavar="DIR",
+        help="keep generated maps in DIR and copy them instead of generating "
+        "again for the same seed, size and config",
+    )
+    parser.add_argument(
+        "--map-cache-size",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="maximum size of the map cache directory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pregenerate",
+        type=int,
+        default=0,
+        metavar="N",
+        help="fill the map pool with N maps at low priority, then exit",
+    )
+    parser.add_argument(
+        "--promote",
+        action="store_true",
+        help="move a pre-generated map into place, generating one if the pool is empty",
+    )
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="generate in bands of rows with the grids in temporary files, "
+        "for maps too large for memory",
+    )
+    parser.add_argument(
+        "--work-dir",
+        metavar="DIR",
+        help="where --out-of-core keeps its temporary files "
+        "(default: the system's temporary directory)",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="run as a daemon generating maps on requests sent to a Unix socket",
+    )
+    parser.add_argument(
+        "--daemon",
+        metavar="SOCKET",
+        help="ask the daemon on SOCKET for the map, generating here if none runs "
+        "or it fails",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write the time, noise samples, placements and peak memory of "
+        "every stage and layer as JSON next to the map",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="with --profile, also write a cProfile dump next to the map",
+    )
+    parser.add_argument(
+        "--no-connectivity-check",
+        dest="check_connectivity",
+        action="store_false",
+        help="place spawn points on any grass, even where walls cut them off "
+        "from each other, instead of only on the largest walkable area",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="processes sampling noise and writing the map in parallel, "
+        "0 for one per CPU (default: 1)",
+    )
+    args = parser.parse_args()
+    if (args.serve or args.daemon) and not hasattr(socket, "AF_UNIX"):
+        parser.error("--serve and --daemon need Unix sockets")
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile needs --profile")
+
+    if args.width is None:
+        mapWidth = 300
+        mapHeight = 300
+        print(
+            f"No custom mapsize specified, using defaults: {mapWidth}w x {mapHeight}h"
+        )
+    elif args.height is None:
+        parser.error("height is required when width is given")
+    else:
+        mapWidth = args.width
+        mapHeight = args.height
+        print(f"Using specified mapsize: {mapWidth}w x {mapHeight}h")
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    cache_options = {
+        "noise_cache_dir": args.noise_cache,
+        "noise_cache_bytes": args.noise_cache_size * 1024**2,
+        "map_cache_dir": args.map_cache,
+        "map_cache_bytes": args.map_cache_size * 1024**2,
+    }
 
-seed_base = random.randint(0, 1000000)
-print(f"Generated seed: {seed_base}")
+    if args.serve:
+        daemon = MapDaemon(args.serve, workers, **cache_options)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    def build_map(seed_base, output_path):
+        if args.daemon:
+            try:
+                reply = request_map(
+                    args.daemon,
+                    width=mapWidth,
+                    height=mapHeight,
+                    seed=seed_base,
+                    output=os.path.abspath(output_path),
+                    out_of_core=args.out_of_core,
+                    profile=args.profile,
+                    cprofile=args.cprofile,
+                    check_connectivity=args.check_connectivity,
+                )
+                print(f"Map generated by the daemon in {reply['seconds']:.2f} seconds")
+                return
+            except OSError:
+                print(f"No map daemon on {args.daemon}, generating here")
+            except RuntimeError as error:
+                print(f"Map daemon failed ({error}), generating here")
+        generate_map(
+            mapWidth,
+            mapHeight,
+            seed_base,
+            output=output_path,
+            workers=workers,
+            out_of_core=args.out_of_core,
+            work_dir=args.work_dir,
+            profile=args.profile,
+            cprofile=args.cprofile,
+            check_connectivity=args.check_connectivity,
+            **cache_options,
+        )
 
-width, height = mapWidth, mapHeight
-chunk_size = 16
+    output_path = default_output_path()
+    pool_dir = os.path.join(os.path.dirname(output_path), "pool")
+    fingerprint = pool_fingerprint(MAP_CONFIG, args.check_connectivity)
 
-biome_tile_layers = [layer for layer in MAP_CONFIG if layer["type"] == "BiomeTileLayer"]
-biome_entity_layers = [
-    layer for layer in MAP_CONFIG if layer["type"] == "BiomeEntityLayer"
-]
+    if args.pregenerate:
+        lower_priority()
+        while True:
+            pool_map = next_pool_map(
+                pool_dir, args.pregenerate, mapWidth, mapHeight, fingerprint
+            )
+            if pool_map is None:
+                break
+            filename, pool_seed = pool_map
+            print(f"Pre-generating pool map with seed {pool_seed}")
+            build_map(pool_seed, os.path.join(pool_dir, filename))
+        print(f"Map pool holds {args.pregenerate} maps of {mapWidth}x{mapHeight}")
+        return
+
+    if args.promote:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        promoted = promote_pool_map(
+            pool_dir, mapWidth, mapHeight, output_path, fingerprint
+        )
+        if promoted is not None:
+            print(f"Promoted pre-generated map {promoted}")
+            return
+        print("Map pool is empty, generating a map now")
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-output_dir = os.path.join(script_dir, "Resources", "Maps", "civ")
-os.makedirs(output_dir, exist_ok=True)
+    start_time = time.time()
 
-tile_map = generate_tile_map(width, height, biome_tile_layers, seed_base)
+    seed_base = args.seed if args.seed is not None else random.randint(0, 1000000)
+    print(f"Generated seed: {seed_base}")
 
-# Applies erosion to lone sand tiles, overwritting it with surrounding tiles
-tile_map = apply_iterative_erosion(
-    tile_map, TILEMAP_REVERSE["FloorSand"], min_neighbors=1
-)
+    build_map(seed_base, output_path)
 
-bordered_tile_map = add_border(tile_map, border_value=TILEMAP_REVERSE["FloorDirt"])
+    end_time = time.time()
+    total_time = end_time - start_time
+    print(f"Map generated and saved in {total_time:.2f} seconds!")
 
-save_map_to_yaml(
-    bordered_tile_map,
-    MAP_CONFIG,
-    output_dir,
-    filename="nomads_classic.yml",
-    chunk_size=chunk_size,
-    seed_base=seed_base,
-)
 
-end_time = time.time()
-total_time = end_time - start_time
-print(f"Map generated and saved in {total_time:.2f} seconds!")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Generates many seeds across a process pool and tabulates every map.
+
+No YAML is written: each map goes through generate_map_parts, the stages
+generate_map runs before writing, and its tile coverage, entity and decal
+counts, the spawn corners found and whether their spawn points are
+connected become one row of a CSV table. The columns are summarised per map
+size, and with --baseline, the table of a run before a MAP_CONFIG change,
+the columns whose mean moved by more than chance explains are listed.
+
+    python mapSweep.py --count 500 --output before.csv
+    python mapSweep.py --count 500 --output after.csv --baseline before.csv
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import mapGeneration as mg
+
+SPAWN_CORNERS = 4
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def sweep_columns(config):
+    """Returns the CSV columns of config's maps, the same for every seed."""
+    protos = []
+    for layer in mg.layers_of_type(config, "BiomeEntityLayer"):
+        protos.extend(as_list(layer["entity_protos"]))
+    protos.append("WallRockIndestructible")
+    decal_ids = []
+    for layer in mg.layers_of_type(config, "BiomeDecalLayer"):
+        decal_ids.extend(as_list(layer["decal_id"]))
+    return (
+        ["width", "height", "seed", "seconds", "spawn_corners", "spawns_connected"]
+        + [f"tile_{name}" for name in mg.TILEMAP.values()]
+        + [f"entity_{proto}" for proto in dict.fromkeys(protos)]
+        + [f"decal_{decal_id}" for decal_id in dict.fromkeys(decal_ids)]
+    )
+
+
+def sweep_map(task):
+    """Generates the map of a (width, height, seed, check) task, returns its row.
+
+    The map goes through generate_map_parts, the stages generate_map runs,
+    with check_connectivity set to check. Tile coverage is the fraction of
+    the map's tiles, the border excluded. Entity counts include the border
+    walls but not the spawn points, which are counted as the corners that
+    got a pair, and spawns_connected is 1 if they can all walk to each other.
+    """
+    width, height, seed, check = task
+    start = time.perf_counter()
+    with mg.quiet():
+        parts = mg.generate_map_parts(
+            width, height, seed, mg.MAP_CONFIG, check_connectivity=check
+        )
+        connected = mg.spawns_connected(parts["tile_map"], parts["store"])
+
+    tiles = parts["tile_map"][1:-1, 1:-1]
+    tile_counts = np.bincount(tiles.ravel(), minlength=max(mg.TILEMAP) + 1)
+    row = {"width": width, "height": height, "seed": seed}
+    for tile_id, name in mg.TILEMAP.items():
+        row[f"tile_{name}"] = round(int(tile_counts[tile_id]) / tiles.size, 6)
+    store = parts["store"]
+    proto_counts = dict(zip(store.protos, store.counts().tolist()))
+    for proto, count in proto_counts.items():
+        if proto not in mg.SPAWN_PROTOS:
+            row[f"entity_{proto}"] = count
+    for decal_id, decals in parts["decals"].items():
+        row[f"decal_{decal_id}"] = len(decals)
+    row["spawn_corners"] = proto_counts["SpawnPointNomads"]
+    row["spawns_connected"] = int(connected)
+    row["seconds"] = round(time.perf_counter() - start, 4)
+    return row
+
+
+def sweep(tasks, workers):
+    """Yields the row of every task, in order, generated by workers processes."""
+    if workers == 1:
+        yield from map(sweep_map, tasks)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(sweep_map, tasks, chunksize=4)
+
+
+def read_table(path):
+    """Reads a sweep CSV into {(width, height): {column: values array}}."""
+    columns = defaultdict(lambda: defaultdict(list))
+    with open(path, newline="") as infile:
+        for row in csv.DictReader(infile):
+            size = (int(row["width"]), int(row["height"]))
+            for column, value in row.items():
+                if value not in ("", None):
+                    columns[size][column].append(float(value))
+    return {
+        size: {column: np.array(values) for column, values in table.items()}
+        for size, table in columns.items()
+    }
+
+
+def value_columns(table):
+    return [column for column in table if column not in ("width", "height", "seed")]
+
+
+def print_summary(tables):
+    """Prints the mean, standard deviation and range of every column per size."""
+    for (width, height), table in sorted(tables.items()):
+        maps = table["seed"].size
+        success = np.mean(table["spawn_corners"] == SPAWN_CORNERS)
+        connected = np.mean(table["spawns_connected"])
+        print(
+            f"{width}x{height}: {maps} maps, spawn points on all corners in "
+            f"{success:.1%} of them and connected in {connected:.1%}"
+        )
+        print(f"  {'column':<40} {'mean':>12} {'std':>12} {'min':>12} {'max':>12}")
+        for column in value_columns(table):
+            values = table[column]
+            print(
+                f"  {column:<40} {values.mean():12.4f} {values.std():12.4f} "
+                f"{values.min():12.4f} {values.max():12.4f}"
+            )
+
+
+def compare(tables, baseline, significance):
+    """Prints the columns whose mean differs from baseline, returns their count.
+
+    A difference counts when it is more than significance standard errors of
+    the difference of the two means.
+    """
+    changed = 0
+    for size, table in sorted(tables.items()):
+        if size not in baseline:
+            continue
+        for column in value_columns(table):
+            if column == "seconds" or column not in baseline[size]:
+                continue
+            after, before = table[column], baseline[size][column]
+            difference = after.mean() - before.mean()
+            error = 0.0
+            if min(after.size, before.size) > 1:
+                error = np.sqrt(
+                    after.var(ddof=1) / after.size + before.var(ddof=1) / before.size
+                )
+            if difference == 0 or abs(difference) <= significance * error:
+                continue
+            changed += 1
+            score = f"{difference / error:+.1f} se" if error > 0 else "no spread"
+            print(
+                f"{size[0]}x{size[1]} {column}: mean {before.mean():.4f} -> "
+                f"{after.mean():.4f} ({score})"
+            )
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates many map seeds and tabulates their statistics."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=mg.map_size,
+        nargs="+",
+        default=[(300, 300)],
+        metavar="WxH",
+        help="map sizes to generate every seed at (default: 300x300)",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=200,
+        metavar="N",
+        help="seeds to generate per size (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--first-seed",
+        type=int,
+        default=0,
+        metavar="SEED",
+        help="the seeds are SEED, SEED + 1, ... (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="processes generating maps, 0 for one per CPU (default: 0)",
+    )
+    parser.add_argument(
+        "--output",
+        default="map_sweep.csv",
+        metavar="FILE",
+        help="where the table is written (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="table of an earlier sweep to compare the column means with",
+    )
+    parser.add_argument(
+        "--significance",
+        type=float,
+        default=3.0,
+        metavar="SE",
+        help="standard errors a mean must move by to be listed against "
+        "--baseline (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-connectivity-check",
+        dest="check_connectivity",
+        action="store_false",
+        help="generate the maps as generate_map does with its connectivity "
+        "check off, spawn points on any grass",
+    )
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    seeds = range(args.first_seed, args.first_seed + args.count)
+    tasks = [
+        (width, height, seed, args.check_connectivity)
+        for width, height in args.sizes
+        for seed in seeds
+    ]
+    print(f"Generating {len(tasks)} maps with {workers} workers")
+
+    start_time = time.time()
+    with open(args.output, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, sweep_columns(mg.MAP_CONFIG), restval=0)
+        writer.writeheader()
+        for done, row in enumerate(sweep(tasks, workers), 1):
+            writer.writerow(row)
+            if done % 50 == 0 or done == len(tasks):
+                elapsed = time.time() - start_time
+                print(f"{done}/{len(tasks)} maps, {done / elapsed * 60:.0f} per minute")
+    print(f"Table written to {args.output}")
+
+    tables = read_table(args.output)
+    print_summary(tables)
+    if args.baseline:
+        changed = compare(tables, read_table(args.baseline), args.significance)
+        if not changed:
+            print("No column mean moved against the baseline")
+
+
+if __name__ == "__main__":
+    main()